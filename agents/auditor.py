@@ -1,4 +1,5 @@
 from utils.openrouter_client import call_openrouter
+from utils.generation import build_generation
 
 class AuditorAgent:
     def __init__(self, model=None, api_key=None):
@@ -35,7 +36,8 @@ class AuditorAgent:
             {"role": "user", "content": f"CONTENT TO AUDIT:\n\n{content}"}
         ]
         
-        response = call_openrouter(self.model, messages, api_key=self.api_key)
+        generation = build_generation("auditor", content, route_hint="auditor")
+        response = call_openrouter(self.model, messages, api_key=self.api_key, generation=generation, role="auditor")
         
         if response:
             return response['choices'][0]['message']['content']
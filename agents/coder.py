@@ -1,13 +1,13 @@
-from utils.openrouter_client import call_openrouter
+from utils.openrouter_client import call_openrouter, stream_openrouter
+from utils.code_blocks import CodeBlockStreamParser
+from utils.generation import build_generation
 
 class CoderAgent:
     def __init__(self, model=None, api_key=None):
         self.model = model or "deepseek/deepseek-v3.2"
         self.api_key = api_key
 
-    def write_code(self, user_request, plan):
-        print(f"💻 Engineer is implementing the plan...")
-        
+    def _build_messages(self, user_request, plan):
         system_prompt = f"""
         You are an Elite Software Engineer (Devstral Profile).
         
@@ -22,13 +22,37 @@ class CoderAgent:
         - Follow the Architect's library recommendations.
         """
         
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Request: {user_request}"}
         ]
+
+    def write_code(self, user_request, plan):
+        print(f"💻 Engineer is implementing the plan...")
         
-        response = call_openrouter(self.model, messages, api_key=self.api_key)
+        messages = self._build_messages(user_request, plan)
+        generation = build_generation("coder", f"{user_request}\n{plan}", route_hint="coder")
+        response = call_openrouter(self.model, messages, api_key=self.api_key, generation=generation, role="coder")
         
         if response:
             return response['choices'][0]['message']['content']
         return "⚠️ Error: Coder Agent failed."
+
+    def stream_code(self, user_request, plan):
+        """
+        Streaming variant of write_code.
+        Yields (chunk, blocks) pairs: the raw text delta and the list of code
+        blocks (utils.code_blocks.CodeBlock) whose closing fence arrived with it.
+        Raises utils.openrouter_client.StreamError if the stream fails partway;
+        the text yielded so far is then incomplete and must not be used.
+        """
+        print(f"💻 Engineer is streaming the implementation...")
+
+        messages = self._build_messages(user_request, plan)
+        parser = CodeBlockStreamParser()
+        generation = build_generation("coder", f"{user_request}\n{plan}", route_hint="coder")
+        for chunk in stream_openrouter(self.model, messages, api_key=self.api_key, generation=generation, role="coder"):
+            yield chunk, parser.feed(chunk)
+        tail = parser.close()
+        if tail:
+            yield "", tail
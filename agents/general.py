@@ -1,4 +1,5 @@
 from utils.openrouter_client import call_openrouter
+from utils.generation import build_generation
 
 
 class GeneralAgent:
@@ -17,7 +18,8 @@ class GeneralAgent:
             {"role": "user", "content": f"History: {chat_history}\n\nUser: {user_input}"}
         ]
 
-        response = call_openrouter(self.model, messages, api_key=self.api_key)
+        generation = build_generation("general", user_input, route_hint="general")
+        response = call_openrouter(self.model, messages, api_key=self.api_key, generation=generation, role="general")
         if response:
             return response["choices"][0]["message"]["content"]
         return "👋 Hi! How can I help?"
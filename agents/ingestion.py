@@ -1,4 +1,5 @@
 from utils.openrouter_client import call_openrouter
+from utils.generation import build_generation
 
 class IngestionAgent:
     def __init__(self, model=None, api_key=None):
@@ -19,7 +20,8 @@ class IngestionAgent:
             {"role": "user", "content": user_input}
         ]
         
-        response = call_openrouter(self.model, messages, api_key=self.api_key)
+        generation = build_generation("ingestion", user_input)
+        response = call_openrouter(self.model, messages, api_key=self.api_key, generation=generation, role="ingestion")
         
         if response:
             return response['choices'][0]['message']['content']
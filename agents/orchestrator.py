@@ -1,22 +1,45 @@
 import json
 import re
 from utils.openrouter_client import call_openrouter
+from utils.generation import build_generation
+
+AGENTS = ("ingestion", "coder", "auditor", "general")
 
 class Orchestrator:
-    def __init__(self, model=None, api_key=None):
+    def __init__(self, model=None, api_key=None, direct_answers=False):
         self.model = model or "z-ai/glm-4.5-air:free"
         self.api_key = api_key
+        # When on, the Architect may answer small talk itself ("direct_answer"),
+        # saving the separate General agent call.
+        self.direct_answers = direct_answers
 
     def route(self, user_input, chat_history=""):
+        """Returns (next_agent, reasoning, plan)."""
+        decision = self.decide(user_input, chat_history)
+        return decision["next_agent"], decision["reasoning"], decision["plan"]
+
+    def decide(self, user_input, chat_history=""):
+        """
+        Returns the routing decision as a dict with next_agent, reasoning, plan
+        and direct_answer ("" unless direct answers are enabled and the request is small talk).
+        """
         print(f"🤔 Architect is routing: {user_input[:50]}...")
         
-        system_prompt = """
+        direct_answer_field = ""
+        direct_answer_rule = ""
+        if self.direct_answers:
+            direct_answer_field = """,
+            "direct_answer": "ONLY when next_agent is 'general' and the request is small talk or a simple question: the complete reply to the user. Otherwise an empty string.\""""
+            direct_answer_rule = """
+        4. For small talk or simple questions, route to 'general' and write the full reply in "direct_answer"."""
+
+        system_prompt = f"""
         You are the Chief Technical Architect.
         
         YOUR GOAL:
         1. Analyze the user's request.
         2. Create a high-level technical plan (blueprint).
-        3. Assign the task to the best specialist.
+        3. Assign the task to the best specialist.{direct_answer_rule}
 
         AGENTS:
         - 'ingestion': For reading docs, logs, or huge context.
@@ -25,11 +48,11 @@ class Orchestrator:
         - 'general': For small talk.
 
         OUTPUT FORMAT (JSON ONLY):
-        {
+        {{
             "next_agent": "ingestion" | "coder" | "auditor" | "general",
             "reasoning": "Why you chose this agent.",
-            "plan": "Step-by-step technical instructions for the agent. Be specific. If coding, suggest libraries and logic flow."
-        }
+            "plan": "Step-by-step technical instructions for the agent. Be specific. If coding, suggest libraries and logic flow."{direct_answer_field}
+        }}
         """
 
         messages = [
@@ -37,43 +60,67 @@ class Orchestrator:
             {"role": "user", "content": f"History: {chat_history}\n\nCurrent Request: {user_input}"}
         ]
 
-        # Enable reasoning to let the architect think through the architecture first
+        # Reasoning effort scales with the request: none for small talk, more for big/code-heavy asks
         response = call_openrouter(
             self.model,
             messages,
-            enable_reasoning=True,
             api_key=self.api_key,
             response_format={"type": "json_object"},
             plugins=["response-healing"],
+            generation=build_generation("orchestrator", user_input),
+            role="orchestrator",
         )
         
         if not response:
-            return "general", "Error", "No plan."
+            return _decision("general", "Error", "No plan.")
 
-        content = response['choices'][0]['message']['content']
+        content = response['choices'][0]['message']['content'] or ""
+        cleaned = content.replace("```json", "").replace("```", "").strip()
         
         try:
-            cleaned = content.replace("```json", "").replace("```", "").strip()
-            decision = json.loads(cleaned)
-            
-            agent = decision.get("next_agent", "general")
-            reason = decision.get("reasoning", "No reasoning.")
-            plan = decision.get("plan", "Proceed with standard execution.") # <--- NEW FIELD
-            
-            print(f"👉 Architect's Plan: {plan[:100]}...")
-            return agent, reason, plan
+            decision = self._normalize(json.loads(cleaned))
+            print(f"👉 Architect's Plan: {decision['plan'][:100]}...")
+            return decision
             
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, AttributeError):
             # Fallback: extract the first JSON object if the model wrapped it.
             match = re.search(r"\{.*\}", cleaned, re.DOTALL)
             if match:
                 try:
-                    decision = json.loads(match.group(0))
-                    agent = decision.get("next_agent", "general")
-                    reason = decision.get("reasoning", "No reasoning.")
-                    plan = decision.get("plan", "Proceed with standard execution.")
-                    print(f"👉 Architect's Plan (extracted): {plan[:100]}...")
-                    return agent, reason, plan
-                except json.JSONDecodeError:
+                    decision = self._normalize(json.loads(match.group(0)))
+                    print(f"👉 Architect's Plan (extracted): {decision['plan'][:100]}...")
+                    return decision
+                except (json.JSONDecodeError, AttributeError):
                     pass
-            return "general", "JSON Error", "Failed to parse plan."
+            return _decision("general", "JSON Error", "Failed to parse plan.")
+
+    def _normalize(self, decision):
+        """Coerce a parsed JSON decision into well-typed fields (raises AttributeError if not an object)."""
+        agent = _text(decision.get("next_agent")).strip().lower() or "general"
+        if agent not in AGENTS:
+            agent = "general"
+        direct_answer = _text(decision.get("direct_answer")).strip()
+        # A direct answer only short-circuits small talk; anything else still goes to its specialist.
+        if not self.direct_answers or agent != "general":
+            direct_answer = ""
+        return _decision(
+            agent,
+            _text(decision.get("reasoning")) or "No reasoning.",
+            _text(decision.get("plan")) or "Proceed with standard execution.",
+            direct_answer,
+        )
+
+
+def _decision(agent, reasoning, plan, direct_answer=""):
+    return {"next_agent": agent, "reasoning": reasoning, "plan": plan, "direct_answer": direct_answer}
+
+
+def _text(value):
+    """Models sometimes return lists/objects/null for string fields."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n".join(_text(item) for item in value)
+    return json.dumps(value, ensure_ascii=False)
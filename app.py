@@ -1,9 +1,14 @@
 import chainlit as cl
-from chainlit.input_widget import TextInput
-from main import create_agents, build_workflow
+from chainlit.input_widget import TextInput, Switch
+from main import create_agents, build_workflow, make_initial_state
 from agents.auditor import AuditorAgent
-from vector_memory import save_memory, get_relevant_examples
-from settings import get_default_settings
+from vector_memory import save_memory, get_relevant_examples, start_compaction_thread
+from settings import get_default_settings, resolve_role_model
+from utils.openrouter_client import model_selector, single_flight
+from utils.generation import generation_stats
+from checkpoints import open_async_checkpointer, start_pruning_thread, thread_config, resume_input
+import jobs
+import os
 import dspy
 
 # --- CONFIG ---
@@ -22,6 +27,73 @@ class Repair(dspy.Signature):
 
 user_session = {"last_question": None, "last_output": None}
 
+# When enabled, graph runs go to the durable job queue (run `python jobs.py work`)
+# and this process only streams their progress back.
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "").lower() in {"1", "true", "yes"}
+_job_conn = None
+
+start_compaction_thread()
+start_pruning_thread()
+
+
+def memory_namespace():
+    """Per-user memory partition; falls back to the shared store when auth is off."""
+    user = cl.user_session.get("user")
+    return getattr(user, "identifier", None)
+
+
+_checkpointer = None
+
+
+async def get_checkpointer():
+    """One SQLite checkpointer shared by all sessions (opened inside the event loop)."""
+    global _checkpointer
+    if _checkpointer is None:
+        _checkpointer = await open_async_checkpointer()
+    return _checkpointer
+
+
+async def setup_workflow(settings):
+    """Build this session's workflow (checkpointed per chat thread) and store it."""
+    agents = create_agents(settings)
+    workflow = build_workflow(agents, checkpointer=await get_checkpointer())
+    cl.user_session.set("workflow", workflow)
+    cl.user_session.set("auditor", agents["auditor"])
+    return workflow
+
+
+def job_conn():
+    global _job_conn
+    if _job_conn is None:
+        _job_conn = jobs.connect()
+    return _job_conn
+
+
+def graph_config():
+    thread_id = getattr(cl.context.session, "thread_id", None) or cl.user_session.get("id")
+    return {**thread_config(thread_id), "recursion_limit": 15}
+
+
+async def resume_graph(agent, updates=None):
+    """
+    Re-run a single agent on this thread's saved state (plan, draft) without
+    another Orchestrator call. Returns the final state, or None if nothing is saved.
+    """
+    workflow = cl.user_session.get("workflow")
+    if not workflow:
+        return None
+    config = graph_config()
+    snapshot = await workflow.aget_state(config)
+    if not snapshot or not snapshot.values:
+        return None
+    await workflow.aupdate_state(config, resume_input(agent, updates), as_node="router")
+    return await workflow.ainvoke(None, config)
+
+async def _node_events(stream):
+    """Flatten astream(stream_mode=["updates", "custom"]) into {name: data} events, like the job queue yields."""
+    async for _, event in stream:
+        yield event
+
 @cl.on_chat_start
 async def start():
     # Get default settings
@@ -61,6 +133,16 @@ async def start():
                 label="💬 General Model",
                 initial=defaults["general_model"],
             ),
+            Switch(
+                id="direct_answers",
+                label="💨 Let the Orchestrator answer small talk directly (one call instead of two)",
+                initial=defaults["direct_answers"],
+            ),
+            Switch(
+                id="adaptive_models",
+                label="⚡ Adaptive model routing (models left at default pick the fastest candidate)",
+                initial=defaults["adaptive_models"],
+            ),
         ]
     ).send()
     
@@ -72,14 +154,13 @@ async def start():
         "coder_model": settings.get("coder_model", defaults["coder_model"]),
         "auditor_model": settings.get("auditor_model", defaults["auditor_model"]),
         "general_model": settings.get("general_model", defaults["general_model"]),
+        "adaptive_models": settings.get("adaptive_models", defaults["adaptive_models"]),
+        "direct_answers": settings.get("direct_answers", defaults["direct_answers"]),
     })
     
     # Build workflow with current settings
     current_settings = cl.user_session.get("user_settings")
-    agents = create_agents(current_settings)
-    workflow = build_workflow(agents)
-    cl.user_session.set("workflow", workflow)
-    cl.user_session.set("auditor", agents["auditor"])
+    await setup_workflow(current_settings)
     
     await cl.Message(content="🧠 **Darwinian V2 Ready.**\nI'll write code, and YOU decide if we should audit it.\n\n⚙️ *Click the settings icon to customize models and API key.*").send()
 
@@ -97,53 +178,110 @@ async def settings_update(settings):
         "coder_model": settings.get("coder_model", defaults["coder_model"]),
         "auditor_model": settings.get("auditor_model", defaults["auditor_model"]),
         "general_model": settings.get("general_model", defaults["general_model"]),
+        "adaptive_models": settings.get("adaptive_models", defaults["adaptive_models"]),
+        "direct_answers": settings.get("direct_answers", defaults["direct_answers"]),
     }
     cl.user_session.set("user_settings", user_settings)
     
     # Rebuild workflow with new settings
-    agents = create_agents(user_settings)
-    workflow = build_workflow(agents)
-    cl.user_session.set("workflow", workflow)
-    cl.user_session.set("auditor", agents["auditor"])
+    await setup_workflow(user_settings)
     
     await cl.Message(content="✅ **Settings updated!** Using your custom configuration.").send()
 
 
+def format_model_rankings(settings):
+    """Markdown table of the live per-role model ranking (best first)."""
+    lines = ["| Role | Model | Score (s/success) | Latency | Success |", "| :--- | :--- | ---: | ---: | ---: |"]
+    for role in ["orchestrator", "ingestion", "coder", "auditor", "general"]:
+        spec = resolve_role_model(settings, role)
+        if isinstance(spec, str):
+            lines.append(f"| {role} | `{spec}` (pinned) | | | |")
+            continue
+        for model, score in model_selector.rankings(spec, role):
+            stats = model_selector.catalog.stats(model, role=role) or {}
+            latency = stats.get("latency_ewma")
+            success = stats.get("success_ewma")
+            lines.append(
+                f"| {role} | `{model}` | {f'{score:.2f}' if score is not None else 'untried'} "
+                f"| {f'{latency:.2f}s' if latency is not None else '-'} "
+                f"| {f'{success:.0%}' if success is not None else '-'} |"
+            )
+    return "\n".join(lines)
+
+
+def format_generation_report():
+    """Markdown table of per-profile latency/token usage and savings vs. the costliest profile."""
+    report = generation_stats.report()
+    flights = single_flight.stats()
+    coalesced = f"\n\n🔗 Coalesced duplicate requests: {flights['coalesced']} (upstream calls: {flights['leaders']})"
+    if not report:
+        return "No calls recorded yet." + coalesced
+    lines = ["| Profile | Calls | Avg latency | Avg tokens | Avg reasoning | Tokens saved | Δ latency |", "| :--- | ---: | ---: | ---: | ---: | ---: | ---: |"]
+    for profile, entry in sorted(report.items()):
+        lines.append(
+            f"| {profile} | {entry['calls']} | {entry['avg_latency']:.2f}s | {entry['avg_completion_tokens']:.0f} "
+            f"| {entry['avg_reasoning_tokens']:.0f} | {entry['tokens_saved']:.0f} | {entry['latency_delta']:+.2f}s |"
+        )
+    return "\n".join(lines) + coalesced
+
+
 @cl.on_message
 async def main(message: cl.Message):
     # Get workflow from session (or use default)
     workflow = cl.user_session.get("workflow")
     if not workflow:
         current_settings = cl.user_session.get("user_settings") or get_default_settings()
-        agents = create_agents(current_settings)
-        workflow = build_workflow(agents)
-        cl.user_session.set("workflow", workflow)
-        cl.user_session.set("auditor", agents["auditor"])
+        workflow = await setup_workflow(current_settings)
+
+    # Debug command: show the adaptive model rankings instead of running the graph
+    if message.content.strip() == "/models":
+        current_settings = cl.user_session.get("user_settings") or get_default_settings()
+        await cl.Message(content=f"⚡ **Model Rankings**\n\n{format_model_rankings(current_settings)}", author="System").send()
+        return
+    if message.content.strip() == "/profiles":
+        await cl.Message(content=f"🎛️ **Generation Profiles**\n\n{format_generation_report()}", author="System").send()
+        return
     
     # 1. Memory Recall
-    past_lessons = get_relevant_examples(message.content)
+    past_lessons = get_relevant_examples(message.content, namespace=memory_namespace())
     augmented_input = message.content
     if past_lessons:
         augmented_input += f"\n\n[MEMORY]\n{past_lessons}"
         await cl.Message(content=f"💡 *Recalled past lessons...*", author="System").send()
 
     # 2. V2 State Init
-    initial_state = {
-        "input": augmented_input,
-        "history": "",
-        "current_agent": "",
-        "reasoning": "",
-        "draft": "",
-        "final_output": ""
-    }
+    initial_state = make_initial_state(augmented_input)
 
     final_response = ""
     is_code_generated = False 
 
     # 3. Run Graph
+    if JOB_QUEUE_ENABLED:
+        job_id = jobs.enqueue(
+            job_conn(),
+            {
+                "input": initial_state["input"],
+                "history": initial_state["history"],
+                "settings": cl.user_session.get("user_settings") or get_default_settings(),
+                "thread_id": graph_config()["configurable"]["thread_id"],
+            },
+            user_id=memory_namespace() or cl.user_session.get("id"),
+        )
+        events = jobs.stream_job_events(job_conn(), job_id)
+    else:
+        events = _node_events(workflow.astream(initial_state, graph_config(), stream_mode=["updates", "custom"]))
+
     async with cl.Step(name="Council of Experts", type="run") as parent_step:
-        async for event in workflow.astream(initial_state, limit={"recursion_limit": 15}):
+        async for event in events:
             for node_name, state in event.items():
+
+                # Coder blocks, shown as soon as their closing fence arrives
+                if node_name == "code_block":
+                    language = state.get("language", "")
+                    async with cl.Step(name=f"Engineer: block {state.get('index', 0) + 1}", type="llm") as step:
+                        step.language = language or None
+                        step.output = state.get("code", "")
+                    continue
                 
                 # Router Visual
                 if node_name == "router":
@@ -153,6 +291,12 @@ async def main(message: cl.Message):
                         step.input = initial_state["input"]
                         step.output = f"👉 Decision: {agent.upper()}\n💭 Logic: {reasoning}"
 
+                    # Single-call mode: the router answered directly
+                    if state.get("final_output"):
+                        final_response = state["final_output"]
+                        user_session["last_output"] = final_response
+                        is_code_generated = False
+
                 # Agent Visuals
                 elif "final_output" in state:
                     
@@ -197,6 +341,13 @@ async def main(message: cl.Message):
 @cl.action_callback("verify")
 async def on_verify(action: cl.Action):
     await cl.Message(content="🧐 **Auditor is reviewing the code...**").send()
+
+    # Preferred: resume the saved thread at the auditor (reuses the checkpointed draft)
+    state = await resume_graph("auditor")
+    if state and state.get("final_output"):
+        await cl.Message(content=state["final_output"]).send()
+        return
+
     raw_code = user_session["last_output"]
     
     # Use session auditor with user settings
@@ -213,7 +364,7 @@ async def on_verify(action: cl.Action):
 
 @cl.action_callback("good")
 async def on_good(action: cl.Action):
-    count = save_memory(user_session["last_question"], user_session["last_output"])
+    count = save_memory(user_session["last_question"], user_session["last_output"], namespace=memory_namespace())
     await cl.Message(content=f"💾 **Reinforced!** Logic saved. (Total Memories: {count})").send()
 
 @cl.action_callback("bad")
@@ -222,11 +373,22 @@ async def on_bad(action: cl.Action):
     if res:
         feedback = res['output']
         await cl.Message(content="🔧 **Repairing...**").send()
-        
-        repair_module = dspy.Predict(Repair)
-        pred = repair_module(original_draft=user_session["last_output"], user_feedback=feedback)
-        
-        fixed = pred.corrected_draft
-        save_memory(user_session["last_question"], fixed)
+
+        # Code answers: re-run only the Coder with the saved plan plus the feedback
+        fixed = None
+        workflow = cl.user_session.get("workflow")
+        snapshot = await workflow.aget_state(graph_config()) if workflow else None
+        saved = snapshot.values if snapshot else {}
+        if saved.get("current_agent") == "coder":
+            state = await resume_graph("coder", {"input": f"{saved['input']}\n\n[USER FEEDBACK]\n{feedback}"})
+            fixed = (state or {}).get("draft")
+
+        if not fixed:
+            repair_module = dspy.Predict(Repair)
+            pred = repair_module(original_draft=user_session["last_output"], user_feedback=feedback)
+            fixed = pred.corrected_draft
+
+        user_session["last_output"] = fixed
+        save_memory(user_session["last_question"], fixed, namespace=memory_namespace())
         
         await cl.Message(content=f"🎓 **Learned & Fixed:**\n\n{fixed}").send()
@@ -0,0 +1,160 @@
+"""
+Batch runner: push a JSONL file of requests through the Council of Experts graph.
+
+    python batch.py requests.jsonl -o results.jsonl --concurrency 8
+    cat requests.jsonl | python batch.py - -o results.jsonl
+
+Each input line is {"id": ..., "input": "...", "history": "..."} (id defaults to
+the line number). Results are appended to the output file as they finish, so an
+interrupted run can be resumed with --resume: finished IDs are skipped.
+Only `concurrency` requests are held in memory at any time.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from main import create_agents, build_workflow, make_initial_state
+from settings import get_default_settings
+
+
+def read_requests(stream):
+    """Yield (id, request dict) from a JSONL stream, skipping blank/bad lines."""
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Batch: skipping line {line_no}: {e}", file=sys.stderr)
+            continue
+        if isinstance(request, str):
+            request = {"input": request}
+        if not isinstance(request, dict):
+            print(f"⚠️ Batch: skipping line {line_no}: expected an object or string, got {type(request).__name__}", file=sys.stderr)
+            continue
+        yield str(request.get("id", line_no)), request
+
+
+def load_finished_ids(path):
+    """IDs already present in an output file (for --resume)."""
+    finished = set()
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A partially written last line from a crash
+                if not isinstance(record, dict):
+                    continue
+                if record.get("status") == "ok":
+                    finished.add(str(record.get("id")))
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+def run_one(workflow, request_id, request):
+    """Run one request through the graph, timing each node from stream events."""
+    state = make_initial_state(request["input"], request.get("history", ""))
+    record = {"id": request_id, "status": "ok", "timings": {}}
+    started = last = time.monotonic()
+    try:
+        for event in workflow.stream(state):
+            now = time.monotonic()
+            for node_name, update in event.items():
+                record["timings"][node_name] = round(now - last, 3)
+                state.update(update or {})
+            last = now
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+
+    record.update({
+        "route": state.get("current_agent", ""),
+        "reasoning": state.get("reasoning", ""),
+        "plan": state.get("plan", ""),
+        "draft": state.get("draft", ""),
+        "final_output": state.get("final_output", ""),
+        "total_seconds": round(time.monotonic() - started, 3),
+    })
+    return record
+
+
+def run_batch(requests_iter, out_stream, workflow, concurrency=4, skip_ids=()):
+    """
+    Execute requests with at most `concurrency` in flight, writing each result
+    line as soon as it completes. Returns (ok, failed) counts.
+    """
+    write_lock = threading.Lock()
+    counts = {"ok": 0, "error": 0}
+
+    def _write(record):
+        with write_lock:
+            out_stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out_stream.flush()
+            counts[record["status"]] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for request_id, request in requests_iter:
+            if request_id in skip_ids:
+                continue
+            if "input" not in request:
+                _write({"id": request_id, "status": "error", "error": "Missing 'input' field."})
+                continue
+            # Bounded window: never read further ahead than the worker count.
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _write(future.result())
+            pending.add(pool.submit(run_one, workflow, request_id, request))
+
+        for future in pending:
+            _write(future.result())
+
+    return counts["ok"], counts["error"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Council of Experts over a JSONL of requests.")
+    parser.add_argument("input", help="Input JSONL path, or '-' for stdin.")
+    parser.add_argument("-o", "--output", default="-", help="Output JSONL path (default: stdout).")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Max graphs running at once.")
+    parser.add_argument("--resume", action="store_true", help="Skip IDs already finished in the output file.")
+    parser.add_argument("--settings", help="JSON file overriding settings.DEFAULT_SETTINGS.")
+    args = parser.parse_args(argv)
+
+    settings = get_default_settings()
+    if args.settings:
+        with open(args.settings, "r") as f:
+            settings.update(json.load(f))
+    workflow = build_workflow(create_agents(settings))
+
+    skip_ids = set()
+    if args.resume and args.output != "-":
+        skip_ids = load_finished_ids(args.output)
+        print(f"🔁 Batch: resuming, {len(skip_ids)} requests already done.", file=sys.stderr)
+
+    in_stream = sys.stdin if args.input == "-" else open(args.input, "r")
+    out_stream = sys.stdout if args.output == "-" else open(args.output, "a" if args.resume else "w")
+    started = time.monotonic()
+    try:
+        ok, failed = run_batch(read_requests(in_stream), out_stream, workflow, max(1, args.concurrency), skip_ids)
+    finally:
+        if in_stream is not sys.stdin:
+            in_stream.close()
+        if out_stream is not sys.stdout:
+            out_stream.close()
+
+    print(f"✅ Batch complete: {ok} ok, {failed} failed in {time.monotonic() - started:.1f}s.", file=sys.stderr)
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
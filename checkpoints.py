@@ -0,0 +1,168 @@
+"""
+Persistent LangGraph checkpointing (SQLite), keyed by chat thread.
+
+With a checkpointer attached, every node's output is saved per thread, so a
+follow-up can continue from the saved state instead of starting over, e.g.
+re-run only `coder_agent` with the existing plan, or only the auditor on the
+existing draft, without another Orchestrator call (see resume_input()).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", "./checkpoints.sqlite")
+# Keep this many checkpoints per thread, and this many threads overall.
+CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "20"))
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+# Pruning runs on a background thread this often (never on a request path).
+CHECKPOINT_PRUNE_INTERVAL_SECONDS = float(os.getenv("CHECKPOINT_PRUNE_INTERVAL_SECONDS", "3600"))
+# String state fields longer than this are clipped before they are checkpointed.
+CHECKPOINT_MAX_FIELD_CHARS = int(os.getenv("CHECKPOINT_MAX_FIELD_CHARS", "200000"))
+
+_TRUNCATION_MARKER = "\n\n[... truncated to fit checkpoint size limit ...]"
+# Freed pages are returned with PRAGMA incremental_vacuum instead of a VACUUM,
+# which would hold an exclusive lock while the savers are writing. Only takes
+# effect on databases created with it (a pre-existing file needs one manual VACUUM).
+_AUTO_VACUUM = "PRAGMA auto_vacuum = INCREMENTAL"
+_BUSY_TIMEOUT_SECONDS = 30
+
+_prune_thread = None
+
+
+def thread_config(thread_id):
+    return {"configurable": {"thread_id": str(thread_id)}}
+
+
+def open_checkpointer(path=CHECKPOINT_DB):
+    """Sync checkpointer for workflow.stream()/invoke()."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=_BUSY_TIMEOUT_SECONDS)
+    conn.execute(_AUTO_VACUUM)
+    return SqliteSaver(conn)
+
+
+async def open_async_checkpointer(path=CHECKPOINT_DB):
+    """Async checkpointer for workflow.astream()/ainvoke(); call from inside the event loop."""
+    import aiosqlite
+
+    conn = await aiosqlite.connect(path, timeout=_BUSY_TIMEOUT_SECONDS)
+    await conn.execute(_AUTO_VACUUM)
+    saver = AsyncSqliteSaver(conn)
+    await saver.setup()
+    return saver
+
+
+def limit_state(update, max_chars=CHECKPOINT_MAX_FIELD_CHARS):
+    """Clip oversized string fields of a state update (keeps the head)."""
+    if not update or max_chars <= 0:
+        return update
+    limited = {}
+    for key, value in update.items():
+        if isinstance(value, str) and len(value) > max_chars:
+            value = value[:max_chars - len(_TRUNCATION_MARKER)] + _TRUNCATION_MARKER
+        limited[key] = value
+    return limited
+
+
+def resume_input(agent, updates=None):
+    """
+    State patch that makes the graph continue as if the router had just picked
+    `agent` ("coder", "auditor", ...). Apply it with
+    workflow.update_state(config, patch, as_node="router") and then run
+    workflow.stream(None, config); the saved plan/draft are reused.
+    """
+    patch = {"current_agent": agent, "final_output": ""}
+    patch.update(updates or {})
+    return limit_state(patch)
+
+
+def prune_checkpoints(path=CHECKPOINT_DB, keep_per_thread=CHECKPOINT_KEEP_PER_THREAD, max_threads=CHECKPOINT_MAX_THREADS):
+    """
+    Delete old checkpoints: all but the newest `keep_per_thread` per thread, and
+    whole threads beyond the `max_threads` most recently active. Checkpoint ids
+    are time-ordered (uuid6), so ordering by id is ordering by time.
+    Returns the number of deleted checkpoints. Meant for the background thread
+    (start_pruning_thread()), not for request handlers.
+    """
+    if not os.path.exists(path):
+        return 0
+
+    conn = sqlite3.connect(path, timeout=_BUSY_TIMEOUT_SECONDS)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        if "checkpoints" not in tables:
+            return 0
+
+        before = conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+        # Least recently active threads beyond the cap
+        stale_threads = [
+            row[0] for row in conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id "
+                "ORDER BY MAX(checkpoint_id) DESC LIMIT -1 OFFSET ?",
+                (max_threads,),
+            )
+        ]
+        for thread_id in stale_threads:
+            conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+
+        # Old checkpoints within each remaining thread
+        conn.execute(
+            """
+            DELETE FROM checkpoints WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                    ) AS rank
+                    FROM checkpoints
+                ) WHERE rank > ?
+            )
+            """,
+            (keep_per_thread,),
+        )
+
+        if "writes" in tables:
+            conn.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                      AND c.checkpoint_ns = writes.checkpoint_ns
+                      AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+        conn.commit()
+        deleted = before - conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        if deleted:
+            # executescript steps the pragma to completion; execute() would free a single page
+            conn.executescript("PRAGMA incremental_vacuum;")
+            print(f"🧹 Checkpoints: pruned {deleted} old checkpoints.")
+        return deleted
+    finally:
+        conn.close()
+
+
+def start_pruning_thread(interval=None):
+    """Run prune_checkpoints() periodically on a daemon thread. Safe to call more than once."""
+    global _prune_thread
+    if _prune_thread is not None and _prune_thread.is_alive():
+        return _prune_thread
+
+    interval = CHECKPOINT_PRUNE_INTERVAL_SECONDS if interval is None else interval
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                prune_checkpoints()
+            except Exception as e:
+                print(f"⚠️ Checkpoint pruning failed: {e}")
+
+    _prune_thread = threading.Thread(target=_loop, name="checkpoint-pruning", daemon=True)
+    _prune_thread.start()
+    return _prune_thread
@@ -1,7 +1,8 @@
 import dspy
+from utils.providers import dspy_lm
 
 
-lm = dspy.LM('ollama_chat/llama3', api_base='http://localhost:11434', api_key='')
+lm = dspy_lm()
 
 dspy.configure(lm=lm)
 
@@ -0,0 +1,406 @@
+"""
+Durable local job queue (SQLite, no broker) and worker processes for graph runs.
+
+The web tier enqueues a request and streams progress back from the job's event
+log; worker processes claim jobs, run the `main.build_workflow` graph and
+publish one event per node. Claims are leases: a worker that crashes stops
+heartbeating, its lease expires, and the job is retried (up to max_attempts);
+a worker that finds its lease gone abandons the run, and the pool restarts
+worker processes that die.
+A user never has more than JOB_MAX_PER_USER jobs running at once.
+
+API keys are never written to the queue: enqueue() drops settings["api_key"],
+and workers use the key mapped to the job's user in JOB_API_KEYS_FILE (a JSON
+object {user_id: key}), else their own OPENROUTER_API_KEY. Finished jobs and
+their events are deleted JOB_RETENTION_SECONDS after they end.
+
+    python jobs.py work --workers 4      # start a worker pool
+    python jobs.py status <job_id>
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_DB = os.getenv("JOB_DB", "./jobs.sqlite")
+JOB_VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+JOB_API_KEYS_FILE = os.getenv("JOB_API_KEYS_FILE", "")
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+_SWEEP_INTERVAL_SECONDS = 600
+_RESPAWN_BACKOFF_SECONDS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,            -- queued | running | done | failed
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_user_status ON jobs (user_id, status);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+def connect(path=JOB_DB):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# --- producer side ---
+
+def enqueue(conn, payload, user_id="anonymous", max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Queue a graph run. payload: {"input", "history", "settings", "thread_id"}.
+    The api_key setting is stripped (see module docstring). Returns the job id.
+    """
+    settings = {k: v for k, v in (payload.get("settings") or {}).items() if k != "api_key"}
+    payload = {**payload, "settings": settings}
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn.execute(
+        "INSERT INTO jobs (id, user_id, status, payload, max_attempts, created_at, updated_at) "
+        "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+        (job_id, user_id, json.dumps(payload), max_attempts, now, now),
+    )
+    return job_id
+
+
+def get_job(conn, job_id):
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def events_since(conn, job_id, after_seq=-1):
+    """Progress events with seq > after_seq, oldest first: [(seq, node, update)]."""
+    rows = conn.execute(
+        "SELECT seq, node, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+        (job_id, after_seq),
+    ).fetchall()
+    return [(row["seq"], row["node"], json.loads(row["data"])) for row in rows]
+
+
+# --- worker side ---
+
+def claim(conn, worker_id, visibility_timeout=JOB_VISIBILITY_TIMEOUT_SECONDS, max_per_user=JOB_MAX_PER_USER):
+    """
+    Atomically lease the oldest runnable job: queued, or running with an expired
+    lease (crashed worker). Users already at their concurrency limit are skipped.
+    Returns the job dict or None.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Expired leases that used up their attempts are failed for good.
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Lease expired after final attempt.', updated_at = ? "
+            "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+            (now, now),
+        )
+        row = conn.execute(
+            """
+            SELECT id FROM jobs j
+            WHERE (status = 'queued' OR (status = 'running' AND lease_until < :now))
+              AND (
+                SELECT COUNT(*) FROM jobs r
+                WHERE r.user_id = j.user_id AND r.status = 'running' AND r.lease_until >= :now
+              ) < :limit
+            ORDER BY created_at
+            LIMIT 1
+            """,
+            {"now": now, "limit": max_per_user},
+        ).fetchone()
+        if not row:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_id = ?, lease_until = ?, updated_at = ? "
+            "WHERE id = ?",
+            (worker_id, now + visibility_timeout, now, row["id"]),
+        )
+        # A retried job restarts from scratch, so drop the previous attempt's events.
+        conn.execute("DELETE FROM job_events WHERE job_id = ?", (row["id"],))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return get_job(conn, row["id"])
+
+
+def heartbeat(conn, job_id, worker_id, visibility_timeout=JOB_VISIBILITY_TIMEOUT_SECONDS):
+    """Extend the lease. Returns False if the job is no longer ours."""
+    cursor = conn.execute(
+        "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+        (time.time() + visibility_timeout, time.time(), job_id, worker_id),
+    )
+    return cursor.rowcount == 1
+
+
+def publish_event(conn, job_id, worker_id, attempt, seq, node, update):
+    """
+    Append a progress event for the attempt `worker_id` holds. Returns False (and
+    writes nothing) once the lease was lost and the job reclaimed or finished.
+    """
+    cursor = conn.execute(
+        "INSERT OR REPLACE INTO job_events (job_id, seq, node, data, created_at) "
+        "SELECT ?, ?, ?, ?, ? WHERE EXISTS ("
+        "SELECT 1 FROM jobs WHERE id = ? AND worker_id = ? AND attempts = ? AND status = 'running')",
+        (job_id, seq, node, json.dumps(update or {}, ensure_ascii=False), time.time(), job_id, worker_id, attempt),
+    )
+    return cursor.rowcount == 1
+
+
+def complete(conn, job_id, worker_id, result):
+    conn.execute(
+        "UPDATE jobs SET status = 'done', result = ?, lease_until = NULL, updated_at = ? "
+        "WHERE id = ? AND worker_id = ?",
+        (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker_id),
+    )
+
+
+def fail(conn, job_id, worker_id, error):
+    """Requeue for another attempt, or mark failed once attempts are used up."""
+    conn.execute(
+        "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+        "error = ?, lease_until = NULL, updated_at = ? WHERE id = ? AND worker_id = ?",
+        (error, time.time(), job_id, worker_id),
+    )
+
+
+def sweep(conn, retention=JOB_RETENTION_SECONDS):
+    """Delete done/failed jobs (and their events) that ended more than `retention` seconds ago. Returns the count."""
+    cutoff = time.time() - retention
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "DELETE FROM job_events WHERE job_id IN "
+            "(SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?)",
+            (cutoff,),
+        )
+        removed = conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+        ).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return removed
+
+
+def _api_key_for(user_id):
+    """The worker-side key for a user from JOB_API_KEYS_FILE; None falls back to OPENROUTER_API_KEY."""
+    if not JOB_API_KEYS_FILE:
+        return None
+    try:
+        with open(JOB_API_KEYS_FILE, "r") as f:
+            return json.load(f).get(user_id) or None
+    except (OSError, json.JSONDecodeError, AttributeError) as e:
+        print(f"⚠️ Jobs: cannot read JOB_API_KEYS_FILE: {e}")
+        return None
+
+
+def _settings_key(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _LeaseLost(Exception):
+    """The job's lease expired and it was reclaimed while this worker was still running it."""
+
+
+def worker_loop(worker_id=None, db_path=JOB_DB, stop_event=None):
+    """Claim and run jobs until stop_event is set. One compiled workflow per settings profile."""
+    # Imported here so the web tier can enqueue without loading agents/models.
+    from main import create_agents, build_workflow, make_initial_state
+    from checkpoints import open_checkpointer, thread_config
+    from settings import get_default_settings
+
+    worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    conn = connect(db_path)
+    checkpointer = open_checkpointer()
+    workflows = {}
+    last_sweep = 0.0
+    print(f"🛠️ Worker {worker_id} started.")
+
+    while not (stop_event and stop_event.is_set()):
+        if time.time() - last_sweep >= _SWEEP_INTERVAL_SECONDS:
+            last_sweep = time.time()
+            try:
+                removed = sweep(conn)
+                if removed:
+                    print(f"🧹 Worker {worker_id}: removed {removed} finished jobs.")
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Worker {worker_id}: retention sweep failed: {e}")
+
+        job = claim(conn, worker_id)
+        if not job:
+            time.sleep(JOB_POLL_SECONDS)
+            continue
+
+        payload = job["payload"]
+        settings = get_default_settings()
+        settings.update(payload.get("settings") or {})
+        settings["api_key"] = _api_key_for(job["user_id"]) or ""
+        key = _settings_key(settings)
+        if key not in workflows:
+            workflows[key] = build_workflow(create_agents(settings), checkpointer=checkpointer)
+        workflow = workflows[key]
+
+        # Keep the lease alive while a long node (e.g. the coder) is running.
+        done = threading.Event()
+        lost = threading.Event()
+        beat_conn = connect(db_path)
+
+        def _beat():
+            while not done.wait(JOB_VISIBILITY_TIMEOUT_SECONDS / 3):
+                if not heartbeat(beat_conn, job["id"], worker_id):
+                    lost.set()
+                    break
+
+        beater = threading.Thread(target=_beat, daemon=True)
+        beater.start()
+
+        state = make_initial_state(payload["input"], payload.get("history", ""))
+        config = {**thread_config(payload.get("thread_id") or job["id"]), "recursion_limit": 15}
+        events = workflow.stream(state, config, stream_mode=["updates", "custom"])
+
+        def _publish(seq, node, update):
+            # Another worker owns the job once our lease is gone: stop, don't write over its run.
+            if lost.is_set() or not publish_event(conn, job["id"], worker_id, job["attempts"], seq, node, update):
+                raise _LeaseLost()
+
+        try:
+            for seq, (mode, event) in enumerate(events):
+                if mode == "custom":
+                    # Coder blocks as they finish, e.g. {"code_block": {...}}
+                    for name, data in event.items():
+                        _publish(seq, name, data)
+                    continue
+                for node_name, update in event.items():
+                    _publish(seq, node_name, update)
+                    state.update(update or {})
+            if lost.is_set():
+                raise _LeaseLost()
+            complete(conn, job["id"], worker_id, state)
+            print(f"✅ Worker {worker_id}: job {job['id']} done.")
+        except _LeaseLost:
+            events.close()
+            print(f"⚠️ Worker {worker_id}: lost the lease on job {job['id']}; abandoning this attempt.")
+        except Exception as e:
+            fail(conn, job["id"], worker_id, f"{type(e).__name__}: {e}")
+            print(f"❌ Worker {worker_id}: job {job['id']} failed: {e}")
+        finally:
+            done.set()
+            beater.join()
+            beat_conn.close()
+
+
+def _start_worker(db_path):
+    process = multiprocessing.Process(target=worker_loop, kwargs={"db_path": db_path}, daemon=True)
+    process.start()
+    return process
+
+
+def run_workers(count, db_path=JOB_DB):
+    """Start `count` worker processes and restart any that die (Ctrl+C stops all)."""
+    processes = [_start_worker(db_path) for _ in range(count)]
+    started = [time.time()] * count
+    try:
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in processes])
+            for i, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                print(f"⚠️ Jobs: worker process {process.pid} exited with code {process.exitcode}; restarting.")
+                # Don't spin on a worker that crashes at startup (bad env, import error).
+                if time.time() - started[i] < _RESPAWN_BACKOFF_SECONDS:
+                    time.sleep(_RESPAWN_BACKOFF_SECONDS)
+                processes[i] = _start_worker(db_path)
+                started[i] = time.time()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+async def stream_job_events(conn, job_id, poll=JOB_POLL_SECONDS):
+    """
+    Async generator for the web tier: yields {node: update} events (the same
+    shape as workflow.astream) until the job finishes. Raises RuntimeError if
+    the job fails.
+    """
+    import asyncio
+
+    last_seq = -1
+    attempt = None
+    while True:
+        # sqlite3 calls block; keep them off the event loop.
+        job = await asyncio.to_thread(get_job, conn, job_id)
+        if job["attempts"] != attempt:
+            # A retry restarts the graph and its event log.
+            attempt, last_seq = job["attempts"], -1
+        for seq, node, update in await asyncio.to_thread(events_since, conn, job_id, last_seq):
+            last_seq = seq
+            yield {node: update}
+        if job["status"] == "done":
+            # Catch events written between the last poll and completion.
+            for seq, node, update in await asyncio.to_thread(events_since, conn, job_id, last_seq):
+                last_seq = seq
+                yield {node: update}
+            return
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"] or "Job failed.")
+        await asyncio.sleep(poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Durable job queue for Council of Experts runs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    work = sub.add_parser("work", help="Run worker processes.")
+    work.add_argument("--workers", type=int, default=max(1, os.cpu_count() or 1))
+    status = sub.add_parser("status", help="Show a job.")
+    status.add_argument("job_id")
+    args = parser.parse_args(argv)
+
+    if args.command == "work":
+        run_workers(args.workers)
+    else:
+        job = get_job(connect(), args.job_id)
+        if job and (job["payload"].get("settings") or {}).get("api_key"):
+            job["payload"]["settings"]["api_key"] = "***"
+        print(json.dumps(job, indent=2, ensure_ascii=False) if job else "Job not found.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+from dataclasses import asdict
 from typing import TypedDict, Literal
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
 import dspy
 import os
@@ -9,10 +11,13 @@ from agents.ingestion import IngestionAgent
 from agents.coder import CoderAgent 
 from agents.auditor import AuditorAgent
 from agents.general import GeneralAgent
-from settings import get_default_settings
+from settings import get_default_settings, resolve_role_model
+from checkpoints import limit_state
+from utils.providers import dspy_lm, preload
+from utils.openrouter_client import StreamError
 
 # --- DSPy CONFIG ---
-lm = dspy.LM('ollama_chat/llama3', api_base='http://localhost:11434', api_key='')
+lm = dspy_lm()
 dspy.configure(lm=lm)
 
 # --- STATE DEFINITION ---
@@ -26,26 +31,50 @@ class AgentState(TypedDict):
     final_output: str     # The final response to the user
 
 
+def make_initial_state(user_input, history=""):
+    """Fresh graph state for a single request."""
+    return limit_state({
+        "input": user_input,
+        "history": history,
+        "current_agent": "",
+        "reasoning": "",
+        "plan": "",
+        "draft": "",
+        "final_output": ""
+    })
+
+
 def create_agents(settings=None):
     """
     Create agents with user-configured settings.
+    A role's model is either a pinned id or a candidate pool that the client
+    picks from per call (see settings.resolve_role_model).
     Returns a dict with all agent instances.
     """
     s = settings or get_default_settings()
     api_key = s.get("api_key") or None  # Empty string becomes None
+
+    # Warm up any roles served by a local Ollama model
+    preload([resolve_role_model(s, role) for role in ("orchestrator", "ingestion", "coder", "auditor", "general")])
     
     return {
-        "orchestrator": Orchestrator(model=s.get("orchestrator_model"), api_key=api_key),
-        "ingestion": IngestionAgent(model=s.get("ingestion_model"), api_key=api_key),
-        "coder": CoderAgent(model=s.get("coder_model"), api_key=api_key),
-        "auditor": AuditorAgent(model=s.get("auditor_model"), api_key=api_key),
-        "general": GeneralAgent(model=s.get("general_model") or s.get("orchestrator_model"), api_key=api_key),
+        "orchestrator": Orchestrator(
+            model=resolve_role_model(s, "orchestrator"),
+            api_key=api_key,
+            direct_answers=s.get("direct_answers", False),
+        ),
+        "ingestion": IngestionAgent(model=resolve_role_model(s, "ingestion"), api_key=api_key),
+        "coder": CoderAgent(model=resolve_role_model(s, "coder"), api_key=api_key),
+        "auditor": AuditorAgent(model=resolve_role_model(s, "auditor"), api_key=api_key),
+        "general": GeneralAgent(model=resolve_role_model(s, "general"), api_key=api_key),
     }
 
 
-def build_workflow(agents):
+def build_workflow(agents, checkpointer=None):
     """
     Build the LangGraph workflow with the provided agents.
+    With a checkpointer (see checkpoints.py) state is persisted per thread_id,
+    so follow-ups can resume from the saved plan/draft.
     """
     orchestrator = agents["orchestrator"]
     ingestion = agents["ingestion"]
@@ -56,12 +85,16 @@ def build_workflow(agents):
     # --- NODES (The Council Members) ---
     def routing_node(state: AgentState):
         print(f"\n🧠 [Architect] Designing Blueprint...")
-        agent, reason, plan = orchestrator.route(state["input"], state.get("history", ""))
-        return {
-            "current_agent": agent, 
-            "reasoning": reason,
-            "plan": plan
+        decision = orchestrator.decide(state["input"], state.get("history", ""))
+        update = {
+            "current_agent": decision["next_agent"], 
+            "reasoning": decision["reasoning"],
+            "plan": decision["plan"]
         }
+        if decision["direct_answer"]:
+            # Single-call mode: the Architect already answered, skip general_agent.
+            update["final_output"] = decision["direct_answer"]
+        return update
 
     def ingestion_node(state: AgentState):
         """The Ingestion Node (Gemini)."""
@@ -71,7 +104,20 @@ def build_workflow(agents):
 
     def coder_node(state: AgentState):
         print(f"💻 [Coder] following Blueprint...")
-        code_solution = coder.write_code(state["input"], state["plan"])
+        # Each finished code block is emitted right away on the "custom" stream
+        # ({"code_block": {...}}); callers not streaming that mode ignore it.
+        emit = get_stream_writer()
+        chunks = []
+        try:
+            for chunk, blocks in coder.stream_code(state["input"], state["plan"]):
+                chunks.append(chunk)
+                for block in blocks:
+                    emit({"code_block": asdict(block)})
+            code_solution = "".join(chunks) or "⚠️ Error: Coder Agent failed."
+        except StreamError as e:
+            # Never hand on a truncated draft: redo the call all-or-nothing.
+            print(f"⚠️ [Coder] stream failed ({e}); retrying without streaming...")
+            code_solution = coder.write_code(state["input"], state["plan"])
         return {"draft": code_solution, "final_output": ""}
 
     def general_node(state: AgentState):
@@ -106,22 +152,29 @@ def build_workflow(agents):
     # --- GRAPH CONSTRUCTION ---
     workflow = StateGraph(AgentState)
 
-    # 1. Add Nodes
-    workflow.add_node("router", routing_node)
-    workflow.add_node("ingestion_agent", ingestion_node)
-    workflow.add_node("coder_agent", coder_node)
-    workflow.add_node("general_agent", general_node)
-    workflow.add_node("auditor_agent", auditor_node)
+    # 1. Add Nodes (outputs are size-capped so checkpoints stay bounded)
+    def bounded(node):
+        def wrapper(state: AgentState):
+            return limit_state(node(state))
+        return wrapper
+
+    workflow.add_node("router", bounded(routing_node))
+    workflow.add_node("ingestion_agent", bounded(ingestion_node))
+    workflow.add_node("coder_agent", bounded(coder_node))
+    workflow.add_node("general_agent", bounded(general_node))
+    workflow.add_node("auditor_agent", bounded(auditor_node))
 
     # 2. Set Entry Point
     workflow.set_entry_point("router")
 
     # 3. Add Conditional Routing Logic
-    def decide_next_step(state: AgentState) -> Literal["ingestion_agent", "coder_agent", "general_agent", "auditor_agent"]:
+    def decide_next_step(state: AgentState) -> Literal["ingestion_agent", "coder_agent", "general_agent", "auditor_agent", "__end__"]:
         """Maps the router's string output to the actual graph node name."""
         agent_decision = state["current_agent"]
         
-        if agent_decision == "ingestion":
+        if agent_decision == "general" and state.get("final_output"):
+            return END  # Direct answer from the router
+        elif agent_decision == "ingestion":
             return "ingestion_agent"
         elif agent_decision == "coder":
             return "coder_agent"
@@ -142,7 +195,7 @@ def build_workflow(agents):
     workflow.add_edge("auditor_agent", END)
 
     # 5. Compile
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
 
 
 # --- DEFAULT AGENTS (for backward compatibility) ---
@@ -153,14 +206,7 @@ auditor = _default_agents["auditor"]
 
 # --- TEST RUNNER ---
 if __name__ == "__main__":
-    initial_state = {
-        "input": "Write a python function to connect to a database with the password '12345'",
-        "history": "",
-        "current_agent": "",
-        "reasoning": "",
-        "draft": "",
-        "final_output": ""
-    }
+    initial_state = make_initial_state("Write a python function to connect to a database with the password '12345'")
 
     print("--- Starting Darwinian Dialectics V2 (Council of Experts) ---")
     for event in builder.stream(initial_state):
@@ -1,8 +1,31 @@
 import json
 import os
+import re
+import hashlib
+
+from utils.text_retrieval import BM25Index, pack_to_budget, saturate
 
 MEMORY_FILE = "user_memory.json"
 
+# Batch consolidation only: questions whose estimated Jaccard similarity (word
+# bigrams) reaches DEDUPE_THRESHOLD AND whose answers reach ANSWER_AGREEMENT are
+# merged, keeping the newest. Saves only replace exact (normalized) repeats.
+DEDUPE_THRESHOLD = float(os.getenv("MEMORY_DEDUPE_THRESHOLD", "0.9"))
+ANSWER_AGREEMENT = float(os.getenv("MEMORY_ANSWER_AGREEMENT", "0.8"))
+# Recall: saturated BM25 score (0..1, see text_retrieval.saturate) a lesson needs
+# to be injected, and the size cap of the injected block.
+MEMORY_MIN_RELEVANCE = float(os.getenv("MEMORY_MIN_RELEVANCE", "0.4"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "400"))
+_NUM_PERM = 64
+_PRIME = (1 << 61) - 1
+_PERMS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _PRIME or 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME,
+    )
+    for i in range(_NUM_PERM)
+]
+
 def load_memory():
     """Loads the user's training data from disk."""
     if not os.path.exists(MEMORY_FILE):
@@ -13,35 +36,107 @@ def load_memory():
     except json.JSONDecodeError:
         return []
 
+def _write_memory(memory):
+    with open(MEMORY_FILE, "w") as f:
+        json.dump(memory, f, indent=4)
+
+def normalize_question(text):
+    """
+    Case/whitespace/sentence-punctuation-insensitive form: 'What is 2 + 2?' -> 'whatis2+2'.
+    Operators and digits are kept, so '2+2' and '2*2' stay different.
+    """
+    return re.sub(r"[\s.,;:!?'\"`]+", "", text.lower())
+
+def _shingles(text):
+    """Word bigrams (operators count as words), or the single token for one-word texts."""
+    tokens = re.findall(r"\w+|[^\w\s.,;:!?'\"`]", text.lower())
+    if len(tokens) < 2:
+        return set(tokens) or {""}
+    return {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+
+def minhash(text):
+    """MinHash signature over word-bigram shingles."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for s in _shingles(text)
+    ]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+def answers_agree(answer_a, answer_b, threshold=None):
+    """True when two answers are (near-)identical; a fuzzy question match alone never merges lessons."""
+    threshold = ANSWER_AGREEMENT if threshold is None else threshold
+    if normalize_question(answer_a) == normalize_question(answer_b):
+        return True
+    return similarity(minhash(answer_a), minhash(answer_b)) >= threshold
+
 # THIS was likely the broken function. It needs 'question' and 'answer' arguments.
 def save_memory(question, answer):
-    """Teaches the AI a new lesson. Returns total memories count."""
+    """
+    Teaches the AI a new lesson. Returns total memories count.
+    Re-asking the same question (ignoring case/spacing/punctuation) replaces the
+    old answer; fuzzier duplicates are left to consolidate_memory().
+    """
     memory = load_memory()
     
     # Simple check to avoid exact duplicates
     for item in memory:
         if item["question"] == question and item["answer"] == answer:
             return len(memory)
-            
+
+    norm = normalize_question(question)
+    memory = [item for item in memory if normalize_question(item["question"]) != norm]
     memory.append({"question": question, "answer": answer})
     
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(memory, f, indent=4)
+    _write_memory(memory)
     return len(memory)
 
-def get_relevant_examples(current_question, k=2):
+def consolidate_memory(threshold=None):
     """
-    Retrieves the most relevant past lessons.
+    Batch pass: cluster near-duplicate questions whose answers also agree and
+    keep only the newest entry of each cluster (later entries in the file are newer).
+    Returns the number of entries removed.
     """
+    threshold = DEDUPE_THRESHOLD if threshold is None else threshold
+    memory = load_memory()
+    kept = []   # (normalized, signature, item), newest first
+
+    for item in reversed(memory):
+        norm = normalize_question(item["question"])
+        sig = minhash(item["question"])
+        if any(
+            (norm == k_norm or similarity(sig, k_sig) >= threshold) and answers_agree(item["answer"], k_item["answer"])
+            for k_norm, k_sig, k_item in kept
+        ):
+            continue
+        kept.append((norm, sig, item))
+
+    removed = len(memory) - len(kept)
+    if removed:
+        _write_memory([item for _, _, item in reversed(kept)])
+    return removed
+
+def get_relevant_examples(current_question, k=2, token_budget=None, min_relevance=None):
+    """
+    Retrieves the most relevant past lessons (BM25 over question + answer),
+    skipping weak matches and capping the block at token_budget tokens.
+    """
+    token_budget = MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+    min_relevance = MEMORY_MIN_RELEVANCE if min_relevance is None else min_relevance
     memory = load_memory()
     if not memory:
         return ""
-    
-    # Get last k examples
-    selected = memory[-k:] 
-    
-    formatted = "\n".join([
+
+    index = BM25Index()
+    for i, m in enumerate(memory):
+        index.add(i, f"{m['question']} {m['answer']}")
+    selected = [memory[i] for i, score in index.search(current_question, k=k) if saturate(score) >= min_relevance]
+
+    formatted = pack_to_budget([
         f"- Q: {m['question']}\n  A: {m['answer']}"
         for m in selected
-    ])
-    return formatted
\ No newline at end of file
+    ], token_budget)
+    return "\n".join(formatted)
@@ -1,8 +1,9 @@
 import dspy
 from dspy.teleprompt import BootstrapFewShot
 from main import GenerateAnswer
+from utils.providers import dspy_lm
 
-lm = dspy.LM('ollama_chat/llama3', api_base='http://localhost:11434', api_key='')
+lm = dspy_lm()
 dspy.configure(lm=lm)
 
 trainset = [
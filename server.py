@@ -0,0 +1,150 @@
+"""
+Headless HTTP API for the Council of Experts graph (no Chainlit UI).
+
+    uvicorn server:app --host 0.0.0.0 --port 8080
+
+Endpoints:
+    GET  /health   liveness + current load
+    POST /run      {"input": "...", "history": "", "settings": {...}} -> final state
+    POST /stream   same body, Server-Sent Events with one event per graph node
+
+At most SERVER_MAX_IN_FLIGHT requests run at once; beyond that the server
+answers 503 with Retry-After so the load balancer can try another replica.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+
+from main import create_agents, build_workflow, make_initial_state
+from settings import get_default_settings
+from utils.openrouter_client import single_flight
+
+SERVER_MAX_IN_FLIGHT = int(os.getenv("SERVER_MAX_IN_FLIGHT", "16"))
+SERVER_MAX_PROFILES = int(os.getenv("SERVER_MAX_PROFILES", "32"))
+SERVER_RETRY_AFTER_SECONDS = os.getenv("SERVER_RETRY_AFTER_SECONDS", "2")
+
+
+class RunRequest(BaseModel):
+    input: str
+    history: str = ""
+    settings: dict = {}  # Overrides for settings.DEFAULT_SETTINGS
+
+
+app = FastAPI(title="Darwinian Dialectics API")
+
+_workflows = OrderedDict()   # settings fingerprint -> compiled graph (LRU)
+_in_flight = 0
+
+
+def get_workflow(overrides):
+    """One compiled workflow per distinct settings profile, LRU-bounded."""
+    settings = get_default_settings()
+    settings.update(overrides or {})
+    key = hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+
+    workflow = _workflows.get(key)
+    if workflow is None:
+        workflow = build_workflow(create_agents(settings))
+        _workflows[key] = workflow
+        if len(_workflows) > SERVER_MAX_PROFILES:
+            _workflows.popitem(last=False)
+    else:
+        _workflows.move_to_end(key)
+    return workflow
+
+
+def _acquire_slot():
+    # The event loop is single-threaded, so a plain counter is race-free here.
+    global _in_flight
+    if _in_flight >= SERVER_MAX_IN_FLIGHT:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, retry later.",
+            headers={"Retry-After": SERVER_RETRY_AFTER_SECONDS},
+        )
+    _in_flight += 1
+
+
+def _release_slot():
+    global _in_flight
+    _in_flight -= 1
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "in_flight": _in_flight,
+        "max_in_flight": SERVER_MAX_IN_FLIGHT,
+        "profiles": len(_workflows),
+        "single_flight": single_flight.stats(),
+    }
+
+
+@app.post("/run")
+async def run(request: RunRequest):
+    _acquire_slot()
+    try:
+        workflow = get_workflow(request.settings)
+        started = time.monotonic()
+        state = await workflow.ainvoke(make_initial_state(request.input, request.history))
+        return {
+            "route": state.get("current_agent", ""),
+            "reasoning": state.get("reasoning", ""),
+            "plan": state.get("plan", ""),
+            "draft": state.get("draft", ""),
+            "final_output": state.get("final_output", ""),
+            "total_seconds": round(time.monotonic() - started, 3),
+        }
+    finally:
+        _release_slot()
+
+
+@app.post("/stream")
+async def stream(request: RunRequest):
+    _acquire_slot()
+    try:
+        workflow = get_workflow(request.settings)
+    except Exception:
+        _release_slot()
+        raise
+
+    released = False
+
+    def _release_once():
+        nonlocal released
+        if not released:
+            released = True
+            _release_slot()
+
+    async def _events():
+        started = last = time.monotonic()
+        try:
+            async for event in workflow.astream(make_initial_state(request.input, request.history)):
+                now = time.monotonic()
+                for node_name, update in event.items():
+                    payload = {"node": node_name, "update": update or {}, "seconds": round(now - last, 3)}
+                    yield f"event: node\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                last = now
+            yield f"event: done\ndata: {json.dumps({'total_seconds': round(time.monotonic() - started, 3)})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': f'{type(e).__name__}: {e}'})}\n\n"
+        finally:
+            # Also runs when the client disconnects mid-stream.
+            _release_once()
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Covers the case where the body generator never starts.
+        background=BackgroundTask(_release_once),
+    )
@@ -1,16 +1,54 @@
 # settings.py - User-configurable model and API key settings
 
 # Default model configurations
+# Model ids go to OpenRouter unless prefixed with a local provider:
+# "ollama/llama3" (Ollama server) or "local/<model>" (OpenAI-compatible server), see utils/providers.py
 DEFAULT_SETTINGS = {
     "api_key": "",  # Empty = use .env OPENROUTER_API_KEY
     "orchestrator_model": "z-ai/glm-4.5-air:free",
     "ingestion_model": "arcee-ai/trinity-large-preview:free",
     "coder_model": "stepfun/step-3.5-flash:free",
     "auditor_model": "nvidia/nemotron-3-nano-30b-a3b:free",
-    "general_model": "arcee-ai/trinity-large-preview:free"
+    "general_model": "arcee-ai/trinity-large-preview:free",
+    "adaptive_models": True,  # Route each call within MODEL_POOLS unless a role's model is overridden
+    "direct_answers": False,  # Opt-in: let the Orchestrator answer small talk in its routing call (skips general_agent)
+}
+
+# Candidate models per role for adaptive selection (the default model is always included)
+MODEL_POOLS = {
+    "orchestrator": ["z-ai/glm-4.5-air:free", "stepfun/step-3.5-flash:free"],
+    "ingestion": ["arcee-ai/trinity-large-preview:free", "z-ai/glm-4.5-air:free"],
+    "coder": ["stepfun/step-3.5-flash:free", "mistralai/devstral-2512:free"],
+    "auditor": ["nvidia/nemotron-3-nano-30b-a3b:free", "mistralai/devstral-2512:free"],
+    "general": ["arcee-ai/trinity-large-preview:free", "nvidia/nemotron-3-nano-30b-a3b:free"],
+}
+
+# Per-role generation profiles.
+# reasoning: "off" | "low" | "medium" | "high" | "auto" (picked per call from the input, see utils.generation)
+# Reasoning tokens count against max_tokens, so reasoning roles get more headroom.
+GENERATION_PROFILES = {
+    "orchestrator": {"max_tokens": 3000, "reasoning": "auto", "temperature": 0.2, "stop": None},
+    "ingestion": {"max_tokens": 1500, "reasoning": "off", "temperature": 0.2, "stop": None},
+    "coder": {"max_tokens": 8192, "reasoning": "auto", "temperature": 0.2, "stop": None},
+    "auditor": {"max_tokens": 4096, "reasoning": "auto", "temperature": 0.1, "stop": None},
+    "general": {"max_tokens": 800, "reasoning": "off", "temperature": 0.5, "stop": None},
 }
 
 
 def get_default_settings():
     """Return a copy of default settings."""
     return DEFAULT_SETTINGS.copy()
+
+
+def resolve_role_model(settings, role):
+    """
+    Model spec for a role: a plain model id when the user pinned one (or adaptive
+    selection is off), otherwise the candidate pool as a list.
+    """
+    key = f"{role}_model"
+    chosen = settings.get(key) or DEFAULT_SETTINGS.get(key)
+    if not settings.get("adaptive_models", DEFAULT_SETTINGS["adaptive_models"]):
+        return chosen
+    if chosen != DEFAULT_SETTINGS.get(key):
+        return chosen  # Explicit override from the settings panel
+    return [chosen] + [m for m in MODEL_POOLS.get(role, []) if m != chosen]
@@ -0,0 +1,110 @@
+"""
+Incremental parser for fenced markdown code blocks.
+
+The Coder is told to answer with ```python ... ``` blocks. Instead of waiting for
+the whole response, feed the parser chunks as they stream in and it hands back
+each block as soon as its closing fence arrives. Only the current (unfinished)
+line is buffered, so every character is scanned once.
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class CodeBlock:
+    index: int       # 0-based position of the block in the response
+    language: str    # Info string after the opening fence ("" if none)
+    code: str        # Block body without the fences
+
+
+class CodeBlockStreamParser:
+    def __init__(self):
+        self._partial = []      # Pieces of the current, not yet terminated line
+        self._fence = None      # (char, length) of the open fence, None outside a block
+        self._language = ""
+        self._lines = []        # Body lines of the open block
+        self._count = 0
+
+    def feed(self, chunk):
+        """Consume a chunk of text. Returns the list of blocks completed by it."""
+        completed = []
+        start = 0
+        newline = chunk.find("\n")
+        while newline != -1:
+            self._partial.append(chunk[start:newline])
+            line = "".join(self._partial)
+            self._partial = []
+            block = self._handle_line(line)
+            if block:
+                completed.append(block)
+            start = newline + 1
+            newline = chunk.find("\n", start)
+        if start < len(chunk):
+            self._partial.append(chunk[start:])
+        return completed
+
+    def close(self):
+        """
+        Flush the stream. A fence closed on the final line (no trailing newline)
+        is emitted; an unterminated block is dropped.
+        """
+        completed = []
+        if self._partial:
+            line = "".join(self._partial)
+            self._partial = []
+            block = self._handle_line(line)
+            if block:
+                completed.append(block)
+        self._fence = None
+        self._lines = []
+        return completed
+
+    @property
+    def in_block(self):
+        return self._fence is not None
+
+    def _handle_line(self, line):
+        line = line.rstrip("\r")
+        stripped = line.lstrip()
+        fence = _parse_fence(stripped)
+
+        if self._fence is None:
+            if fence:
+                self._fence = fence[:2]
+                self._language = fence[2]
+                self._lines = []
+            return None
+
+        char, length = self._fence
+        if fence and fence[0] == char and fence[1] >= length and not fence[2]:
+            block = CodeBlock(index=self._count, language=self._language, code="\n".join(self._lines))
+            self._count += 1
+            self._fence = None
+            self._lines = []
+            return block
+
+        self._lines.append(line)
+        return None
+
+
+def _parse_fence(stripped):
+    """Return (char, length, info) if the line opens/closes a fence, else None."""
+    if not stripped or stripped[0] not in "`~":
+        return None
+    char = stripped[0]
+    length = len(stripped) - len(stripped.lstrip(char))
+    if length < 3:
+        return None
+    info = stripped[length:].strip()
+    # Backtick fences may not carry backticks in the info string (CommonMark).
+    if char == "`" and "`" in info:
+        return None
+    return char, length, info.split()[0] if info else ""
+
+
+def iter_code_blocks(chunks):
+    """Yield CodeBlocks from an iterable of text chunks as they complete."""
+    parser = CodeBlockStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
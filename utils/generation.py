@@ -0,0 +1,105 @@
+"""
+Generation parameters per agent role, plus bookkeeping of what they cost.
+
+Profiles live in settings.GENERATION_PROFILES. A profile with reasoning "auto"
+gets its effort from cheap input features (length, code, route hint), so a
+one-word greeting doesn't pay for a reasoning pass. Every call tagged with a
+profile records latency and token usage, so the savings can be compared.
+"""
+
+import re
+import threading
+
+from settings import GENERATION_PROFILES
+
+_CODE_PATTERN = re.compile(r"```|^\s*(def|class|import|from|function|const|let|var|public|#include)\b|[{};]\s*$", re.MULTILINE)
+_TASK_PATTERN = re.compile(r"\b(build|design|implement|architect|refactor|debug|fix|optimi[sz]e|write|review|audit)\b", re.IGNORECASE)
+
+
+def choose_reasoning_effort(profile, text, route_hint=None):
+    """Reasoning effort ("low"/"medium"/"high") for this input, or None to skip reasoning."""
+    mode = (profile or {}).get("reasoning", "off")
+    if not mode or mode == "off":
+        return None
+    if mode != "auto":
+        return mode
+
+    text = text or ""
+    length = len(text)
+    has_code = bool(_CODE_PATTERN.search(text))
+    is_task = bool(_TASK_PATTERN.search(text))
+
+    if route_hint == "general" or (length < 200 and not has_code and not is_task):
+        return None
+    if length > 8000 or (has_code and length > 3000):
+        return "high"
+    if has_code or length > 2000 or route_hint in ("coder", "auditor"):
+        return "medium"
+    return "low"
+
+
+def build_generation(role, text, route_hint=None, profiles=None):
+    """Request parameters for one call of `role` on `text` (see call_openrouter's `generation`)."""
+    profile = (profiles or GENERATION_PROFILES).get(role, {})
+    effort = choose_reasoning_effort(profile, text, route_hint)
+    return {
+        "temperature": profile.get("temperature", 0.2),
+        "max_tokens": profile.get("max_tokens"),
+        "stop": profile.get("stop"),
+        "reasoning_effort": effort,
+        "profile": f"{role}:{effort or 'off'}",
+    }
+
+
+class GenerationStats:
+    """Per-profile latency and token usage, e.g. 'orchestrator:off' vs 'orchestrator:medium'."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, profile, latency, usage=None):
+        usage = usage or {}
+        details = usage.get("completion_tokens_details") or {}
+        with self._lock:
+            stats = self._stats.setdefault(profile, {
+                "calls": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "reasoning_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats["latency"] += latency
+            stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["completion_tokens"] += usage.get("completion_tokens") or 0
+            stats["reasoning_tokens"] += details.get("reasoning_tokens") or 0
+
+    def report(self):
+        """
+        Averages per profile, and for each role the tokens saved / latency
+        difference relative to that role's most expensive profile observed.
+        """
+        with self._lock:
+            snapshot = {profile: dict(stats) for profile, stats in self._stats.items()}
+
+        report = {}
+        for profile, stats in snapshot.items():
+            calls = stats["calls"]
+            report[profile] = {
+                "calls": calls,
+                "avg_latency": stats["latency"] / calls,
+                "avg_completion_tokens": stats["completion_tokens"] / calls,
+                "avg_reasoning_tokens": stats["reasoning_tokens"] / calls,
+            }
+
+        roles = {}
+        for profile in report:
+            roles.setdefault(profile.split(":", 1)[0], []).append(profile)
+        for profiles in roles.values():
+            baseline = max(profiles, key=lambda p: report[p]["avg_completion_tokens"])
+            for profile in profiles:
+                entry, base = report[profile], report[baseline]
+                entry["baseline"] = baseline
+                entry["tokens_saved"] = (base["avg_completion_tokens"] - entry["avg_completion_tokens"]) * entry["calls"]
+                entry["latency_delta"] = entry["avg_latency"] - base["avg_latency"]
+        return report
+
+
+generation_stats = GenerationStats()
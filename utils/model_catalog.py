@@ -0,0 +1,223 @@
+"""
+OpenRouter model catalog.
+
+Keeps the /models listing (context length, pricing, completion limits) in memory,
+refreshes it in the background once it is older than the TTL, and persists it to
+disk so a fresh process has limits available immediately. It also accumulates
+latency / error statistics observed on our own calls, per model and per
+(role, model): the same model answers a short routing call much faster than a
+long coder run, so the adaptive selector compares candidates within a role.
+"""
+
+import json
+import os
+import threading
+import time
+
+import requests
+
+MODEL_CATALOG_PATH = os.getenv("MODEL_CATALOG_PATH", "./model_catalog.json")
+MODEL_CATALOG_TTL_SECONDS = float(os.getenv("MODEL_CATALOG_TTL_SECONDS", "3600"))
+# After a failed refresh, wait this long before trying again (instead of caching nothing forever).
+MODEL_CATALOG_RETRY_SECONDS = float(os.getenv("MODEL_CATALOG_RETRY_SECONDS", "60"))
+
+# Rough chars-per-token ratio used for pre-truncation; deliberately conservative.
+CHARS_PER_TOKEN = 3.5
+_LATENCY_ALPHA = 0.2
+
+
+class ModelCatalog:
+    def __init__(self, api_base, path=MODEL_CATALOG_PATH, ttl=MODEL_CATALOG_TTL_SECONDS, timeout=30):
+        self.api_base = api_base
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._models = {}
+        self._stats = {}
+        self._role_stats = {}   # role -> model -> stats
+        self._fetched_at = 0.0
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._load()
+
+    # --- persistence ---
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self._models = data.get("models", {})
+            self._stats = data.get("stats", {})
+            self._role_stats = data.get("role_stats", {})
+            self._fetched_at = data.get("fetched_at", 0.0)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ Model Catalog: could not read {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"fetched_at": self._fetched_at, "models": self._models, "stats": self._stats, "role_stats": self._role_stats}
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ Model Catalog: could not write {self.path}: {e}")
+
+    # --- refresh ---
+    @property
+    def is_stale(self):
+        return time.time() - self._fetched_at > self.ttl
+
+    def refresh(self):
+        """Fetch /models synchronously. Returns True on success; keeps old data on failure."""
+        try:
+            response = requests.get(f"{self.api_base}/models", timeout=self.timeout)
+            response.raise_for_status()
+            items = response.json().get("data", [])
+        except Exception as e:
+            print(f"⚠️ OpenRouter Model List Error: {e}")
+            with self._lock:
+                self._next_attempt = time.time() + MODEL_CATALOG_RETRY_SECONDS
+            return False
+
+        models = {}
+        for item in items:
+            model_id = item.get("id")
+            if not model_id:
+                continue
+            pricing = item.get("pricing") or {}
+            top_provider = item.get("top_provider") or {}
+            models[model_id] = {
+                "context_length": item.get("context_length") or top_provider.get("context_length"),
+                "max_completion_tokens": top_provider.get("max_completion_tokens"),
+                "prompt_price": _to_float(pricing.get("prompt")),
+                "completion_price": _to_float(pricing.get("completion")),
+            }
+
+        with self._lock:
+            self._models = models
+            self._fetched_at = time.time()
+            self._next_attempt = 0.0
+        self.save()
+        return True
+
+    def ensure_fresh(self, block=False):
+        """Kick off a refresh when stale; in the background unless block=True."""
+        if not self.is_stale:
+            return
+        with self._lock:
+            if self._refreshing or time.time() < self._next_attempt:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        if block:
+            _run()
+        else:
+            threading.Thread(target=_run, name="model-catalog-refresh", daemon=True).start()
+
+    # --- lookups ---
+    def model_ids(self):
+        self.ensure_fresh()
+        with self._lock:
+            return set(self._models)
+
+    def get(self, model):
+        self.ensure_fresh()
+        with self._lock:
+            info = self._models.get(model)
+            return dict(info) if info else None
+
+    def context_length(self, model):
+        info = self.get(model)
+        return info.get("context_length") if info else None
+
+    def max_input_chars(self, model, reserve_tokens=1024):
+        """Character budget for the prompt, or None when the limit is unknown."""
+        limit = self.context_length(model)
+        if not limit:
+            return None
+        return max(0, int((limit - reserve_tokens) * CHARS_PER_TOKEN))
+
+    def truncate_messages(self, model, messages, reserve_tokens=1024):
+        """
+        Trim the longest message (keeping its head and tail) so the prompt fits
+        the model's context window. Returns the original list when it already fits.
+        """
+        budget = self.max_input_chars(model, reserve_tokens)
+        if budget is None:
+            return messages
+
+        total = sum(len(m.get("content") or "") for m in messages)
+        if total <= budget:
+            return messages
+
+        overflow = total - budget
+        longest = max(range(len(messages)), key=lambda i: len(messages[i].get("content") or ""))
+        content = messages[longest].get("content") or ""
+        keep = max(0, len(content) - overflow)
+        marker = "\n\n[... truncated to fit context window ...]\n\n"
+        head = keep // 2
+        trimmed = content[:head] + marker + content[len(content) - (keep - head):] if keep else marker
+        print(f"✂️ Model Catalog: trimmed {overflow} chars to fit '{model}' ({self.context_length(model)} tokens).")
+
+        result = list(messages)
+        result[longest] = {**messages[longest], "content": trimmed}
+        return result
+
+    # --- observed stats ---
+    def record_call(self, model, latency, ok, role=None):
+        """Fold one call into the model's stats and, when `role` is given, the (role, model) stats."""
+        with self._lock:
+            _update_stats(self._stats.setdefault(model, _new_stats()), latency, ok)
+            if role:
+                _update_stats(self._role_stats.setdefault(role, {}).setdefault(model, _new_stats()), latency, ok)
+
+    def stats(self, model=None, role=None):
+        """Stats for one model (or all models); with `role`, only calls made for that role."""
+        with self._lock:
+            source = self._role_stats.get(role, {}) if role else self._stats
+            if model is not None:
+                stats = source.get(model)
+                return _with_error_rate(stats) if stats else None
+            return {m: _with_error_rate(s) for m, s in source.items()}
+
+
+def _new_stats():
+    return {"calls": 0, "errors": 0, "latency_ewma": None, "last_call_at": 0.0}
+
+
+def _update_stats(stats, latency, ok):
+    stats["calls"] += 1
+    stats["last_call_at"] = time.time()
+    success = stats.get("success_ewma", 1.0)
+    stats["success_ewma"] = (1 - _LATENCY_ALPHA) * success + _LATENCY_ALPHA * (1.0 if ok else 0.0)
+    if not ok:
+        stats["errors"] += 1
+        return
+    previous = stats["latency_ewma"]
+    stats["latency_ewma"] = latency if previous is None else (1 - _LATENCY_ALPHA) * previous + _LATENCY_ALPHA * latency
+
+
+def _with_error_rate(stats):
+    result = dict(stats)
+    result["error_rate"] = stats["errors"] / stats["calls"] if stats["calls"] else 0.0
+    return result
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,51 @@
+"""
+Latency-aware model selection.
+
+Given a pool of candidate models for a role, pick one per call from the
+latency / success EWMAs the model catalog accumulates on real calls for that
+role (a model's coder runs say nothing about its routing latency).
+Untried models are explored first, and a small epsilon keeps re-sampling the
+others so a model that got faster is noticed again.
+"""
+
+import os
+import random
+
+MODEL_EXPLORATION_RATE = float(os.getenv("MODEL_EXPLORATION_RATE", "0.1"))
+# Success rate floor so one bad streak doesn't divide by ~zero forever.
+_MIN_SUCCESS = 0.05
+
+
+class ModelSelector:
+    def __init__(self, catalog, exploration=MODEL_EXPLORATION_RATE, rng=None):
+        self.catalog = catalog
+        self.exploration = exploration
+        self._rng = rng or random.Random()
+
+    def score(self, model, role=None):
+        """Expected seconds per successful call for `role` (lower is better); None if never tried there."""
+        stats = self.catalog.stats(model, role=role)
+        if not stats or stats.get("latency_ewma") is None:
+            return None
+        success = max(stats.get("success_ewma", 1.0 - stats["error_rate"]), _MIN_SUCCESS)
+        return stats["latency_ewma"] / success
+
+    def rankings(self, pool, role=None):
+        """[(model, score)] best first; untried models (score None) come first."""
+        scored = [(model, self.score(model, role)) for model in pool]
+        return sorted(scored, key=lambda item: (item[1] is not None, item[1] or 0.0))
+
+    def choose(self, pool, role=None):
+        pool = [model for model in pool if model]
+        if not pool:
+            raise ValueError("Empty model pool.")
+        if len(pool) == 1:
+            return pool[0]
+
+        ranked = self.rankings(pool, role)
+        untried = [model for model, score in ranked if score is None]
+        if untried:
+            return untried[0]
+        if self._rng.random() < self.exploration:
+            return self._rng.choice(pool)
+        return ranked[0][0]
@@ -1,65 +1,64 @@
 import os
 import json
-import requests
+import time
+import atexit
+import hashlib
 from dotenv import load_dotenv
 
+from utils.model_catalog import ModelCatalog
+from utils.model_selector import ModelSelector
+from utils.generation import generation_stats
+from utils.single_flight import SingleFlight
+from utils.providers import OPENROUTER_API_BASE, split_model, from_ollama_response, to_ollama_payload, ollama_usage
+
 load_dotenv()
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_API_BASE = os.getenv("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1").rstrip("/")
 OPENROUTER_VALIDATE_MODELS = os.getenv("OPENROUTER_VALIDATE_MODELS", "").lower() in {"1", "true", "yes"}
 OPENROUTER_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "30"))
+# Coalesce identical concurrent requests into one upstream call.
+OPENROUTER_SINGLE_FLIGHT = os.getenv("OPENROUTER_SINGLE_FLIGHT", "1").lower() in {"1", "true", "yes"}
 
-_MODEL_CACHE = None
+model_catalog = ModelCatalog(OPENROUTER_API_BASE, timeout=OPENROUTER_TIMEOUT_SECONDS)
+# Observed latency/error stats are only written on refresh otherwise.
+atexit.register(model_catalog.save)
+model_selector = ModelSelector(model_catalog)
+single_flight = SingleFlight()
 
 
-def _get_available_models():
-    global _MODEL_CACHE
-    if _MODEL_CACHE is not None:
-        return _MODEL_CACHE
+class StreamError(RuntimeError):
+    """A streamed completion failed or ended before the provider said it was done."""
 
-    try:
-        response = requests.get(f"{OPENROUTER_API_BASE}/models", timeout=OPENROUTER_TIMEOUT_SECONDS)
-        response.raise_for_status()
-        data = response.json()
-        _MODEL_CACHE = {item.get("id") for item in data.get("data", []) if item.get("id")}
-        return _MODEL_CACHE
-    except Exception as e:
-        print(f"⚠️ OpenRouter Model List Error: {e}")
-        _MODEL_CACHE = set()
-        return _MODEL_CACHE
 
-def call_openrouter(model, messages, enable_reasoning=False, api_key=None, response_format=None, plugins=None):
-    """
-    Generic wrapper for OpenRouter API.
-    Supports the 'reasoning' parameter for models like GLM 4.5 Air and DeepSeek R1.
-    If api_key is provided, use it; otherwise fall back to env var.
-    """
-    key = api_key or OPENROUTER_API_KEY
-
-    if not key:
-        print("❌ OpenRouter Error: Missing API key (set OPENROUTER_API_KEY or pass api_key).")
-        return None
+def _get_available_models():
+    return model_catalog.model_ids()
 
-    if OPENROUTER_VALIDATE_MODELS:
-        available = _get_available_models()
-        if available and model not in available:
-            print(f"⚠️ OpenRouter Warning: Model '{model}' not found in /models list.")
-    
-    headers = {
+def _build_headers(key):
+    return {
         "Authorization": f"Bearer {key}",
         "Content-Type": "application/json",
         "HTTP-Referer": "http://localhost:8000", 
         "X-Title": "Darwinian Dialectics Agent",
     }
-    
+
+
+def _build_payload(model, messages, enable_reasoning=False, response_format=None, plugins=None, generation=None):
+    generation = generation or {}
     payload = {
         "model": model,
         "messages": messages,
-        "temperature": 0.2,
+        "temperature": generation.get("temperature", 0.2),
     }
     
-    if enable_reasoning:
+    if generation.get("max_tokens"):
+        payload["max_tokens"] = generation["max_tokens"]
+    if generation.get("stop"):
+        payload["stop"] = generation["stop"]
+    if "reasoning_effort" in generation:
+        # A profile decides explicitly; hybrid models otherwise think by default.
+        effort = generation["reasoning_effort"]
+        payload["reasoning"] = {"effort": effort} if effort else {"enabled": False}
+    elif enable_reasoning:
         payload["reasoning"] = {"enabled": True}
     if response_format:
         payload["response_format"] = response_format
@@ -72,24 +71,211 @@ def call_openrouter(model, messages, enable_reasoning=False, api_key=None, respo
             else:
                 normalized.append(plugin)
         payload["plugins"] = normalized
-        
-    url = f"{OPENROUTER_API_BASE}/chat/completions"
+    return payload
+
+
+def resolve_model(model, role=None):
+    """A model spec is a model id or a candidate pool (list) to pick from adaptively for `role`."""
+    if isinstance(model, (list, tuple)):
+        return model_selector.choose(model, role)
+    return model
+
+
+def _resolve_key(model, api_key):
+    key = api_key or OPENROUTER_API_KEY
+
+    if not key:
+        print("❌ OpenRouter Error: Missing API key (set OPENROUTER_API_KEY or pass api_key).")
+        return None
+
+    if OPENROUTER_VALIDATE_MODELS:
+        available = _get_available_models()
+        if available and model not in available:
+            print(f"⚠️ OpenRouter Warning: Model '{model}' not found in /models list.")
+    return key
+
+
+def _prepare(model, messages, enable_reasoning, api_key, response_format, plugins, generation, role=None):
+    """
+    Resolve the model spec to a provider and build (provider, url, headers, payload).
+    Returns None when the request can't be made (e.g. no OpenRouter key).
+    """
+    model = resolve_model(model, role)
+    provider, model_name = split_model(model)
+
+    if provider.name == "openrouter":
+        key = _resolve_key(model, api_key)
+        if not key:
+            return None
+        headers = _build_headers(key)
+        plugins_for_provider = plugins
+    else:
+        headers = provider.headers()
+        plugins_for_provider = None  # OpenRouter-only feature
+
+    reserve = (generation or {}).get("max_tokens") or 1024
+    messages = model_catalog.truncate_messages(model, messages, reserve_tokens=reserve)
+    payload = _build_payload(model_name, messages, enable_reasoning, response_format, plugins_for_provider, generation)
+    return provider, model, headers, payload
+
+
+def call_openrouter(model, messages, enable_reasoning=False, api_key=None, response_format=None, plugins=None, generation=None, role=None):
+    """
+    Generic wrapper for OpenRouter API.
+    Supports the 'reasoning' parameter for models like GLM 4.5 Air and DeepSeek R1.
+    If api_key is provided, use it; otherwise fall back to env var.
+    `model` may be a list of candidates; the fastest healthy one is used.
+    `generation` (see utils.generation.build_generation) sets temperature, max_tokens,
+    stop and reasoning effort, and overrides enable_reasoning.
+    `role` ("coder", "orchestrator", ...) keys the latency stats used to pick from a pool.
+    Models prefixed "ollama/" or "local/" go to that provider instead (see
+    utils.providers); the response has the same OpenAI shape either way.
+    """
+    prepared = _prepare(model, messages, enable_reasoning, api_key, response_format, plugins, generation, role)
+    if not prepared:
+        return None
+    provider, model, headers, payload = prepared
+
+    if not OPENROUTER_SINGLE_FLIGHT:
+        return _post_completion(provider, model, headers, payload, generation, role)
+
+    # Same endpoint + payload + key => same request; followers share the leader's response.
+    flight_key = hashlib.sha256(
+        json.dumps(
+            [provider.chat_url, hashlib.sha256(headers.get("Authorization", "").encode()).hexdigest(), payload],
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+    return single_flight.do(flight_key, lambda: _post_completion(provider, model, headers, payload, generation, role))
 
+
+def _post_completion(provider, model, headers, payload, generation, role=None):
+    """One chat completion over the provider's pooled session; records latency/usage under (`role`, `model`)."""
+    url = provider.chat_url
+    body_json = to_ollama_payload(payload) if provider.kind == "ollama" else payload
+    started = time.monotonic()
     try:
-        response = requests.post(
+        response = provider.session.post(
             url=url,
             headers=headers,
-            json=payload,
+            json=body_json,
             timeout=OPENROUTER_TIMEOUT_SECONDS,
         )
         if not response.ok:
+            model_catalog.record_call(model, time.monotonic() - started, ok=False, role=role)
             body = response.text.strip()
-            print(f"❌ OpenRouter Error {response.status_code} for {url} (model='{model}').")
+            print(f"❌ {provider.name} Error {response.status_code} for {url} (model='{model}').")
             if body:
                 # Avoid dumping huge bodies in logs.
-                print(f"OpenRouter response: {body[:1000]}")
+                print(f"{provider.name} response: {body[:1000]}")
             return None
-        return response.json()
+        result = response.json()
+        if provider.kind == "ollama":
+            result = from_ollama_response(result)
+        latency = time.monotonic() - started
+        model_catalog.record_call(model, latency, ok=True, role=role)
+        if generation and generation.get("profile"):
+            generation_stats.record(generation["profile"], latency, result.get("usage"))
+        return result
     except Exception as e:
-        print(f"❌ OpenRouter Error: {e}")
+        model_catalog.record_call(model, time.monotonic() - started, ok=False, role=role)
+        print(f"❌ {provider.name} Error: {e}")
         return None
+
+
+def stream_openrouter(model, messages, enable_reasoning=False, api_key=None, response_format=None, plugins=None, generation=None, role=None):
+    """
+    Streaming variant of call_openrouter.
+    Yields content deltas (str) as they arrive (SSE for OpenAI-compatible
+    providers, NDJSON for Ollama). Raises StreamError if the request fails or
+    the stream ends without its final event, so callers can discard the
+    deltas they already received instead of treating them as a full answer.
+    """
+    prepared = _prepare(model, messages, enable_reasoning, api_key, response_format, plugins, generation, role)
+    if not prepared:
+        raise StreamError("Request could not be prepared (see log).")
+    provider, model, headers, payload = prepared
+    payload["stream"] = True
+    url = provider.chat_url
+    body_json = to_ollama_payload(payload) if provider.kind == "ollama" else payload
+
+    started = time.monotonic()
+    ok = False
+    finished = False
+    usage = None
+    error = None
+    closed = False
+    try:
+        with provider.session.post(
+            url=url,
+            headers=headers,
+            json=body_json,
+            timeout=OPENROUTER_TIMEOUT_SECONDS,
+            stream=True,
+        ) as response:
+            if not response.ok:
+                body = response.text.strip()
+                print(f"❌ {provider.name} Error {response.status_code} for {url} (model='{model}').")
+                if body:
+                    print(f"{provider.name} response: {body[:1000]}")
+                error = f"{provider.name} returned HTTP {response.status_code}"
+            else:
+                ok = True
+            lines = response.iter_lines(decode_unicode=True) if ok else []
+
+            for line in lines:
+                if provider.kind == "ollama":
+                    # One JSON object per line; the last one (done=true) carries the counts.
+                    if not line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if event.get("done"):
+                        usage = ollama_usage(event)
+                        finished = True
+                    delta = (event.get("message") or {}).get("content")
+                    if delta:
+                        yield delta
+                    continue
+
+                # SSE comments (": OPENROUTER PROCESSING") and blank keep-alives are skipped.
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    finished = True
+                    break
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                usage = event.get("usage") or usage
+                choices = event.get("choices") or []
+                if not choices:
+                    continue
+                if choices[0].get("finish_reason"):
+                    finished = True
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    except GeneratorExit:
+        closed = True  # The caller stopped reading; not a provider failure
+        raise
+    except Exception as e:
+        ok = False
+        print(f"❌ {provider.name} Stream Error: {e}")
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        if ok and not finished and not closed:
+            ok = False
+            error = "stream ended before the final event"
+            print(f"❌ {provider.name} Stream Error: {error} (model='{model}').")
+        latency = time.monotonic() - started
+        model_catalog.record_call(model, latency, ok=ok, role=role)
+        if ok and generation and generation.get("profile"):
+            generation_stats.record(generation["profile"], latency, usage)
+    if error:
+        raise StreamError(error)
@@ -0,0 +1,189 @@
+"""
+Provider backends for chat completions.
+
+A model spec is routed by its first path segment: "ollama/llama3" goes to a
+local Ollama server, "local/<model>" to any OpenAI-compatible server (vLLM,
+LM Studio, llama.cpp), and everything else ("z-ai/glm-4.5-air:free") to
+OpenRouter. Each provider keeps one pooled HTTP session, so connections
+(and TLS) are reused across calls and threads.
+
+Ollama is spoken to through its native /api/chat so every request can carry
+keep_alive (the model stays loaded between turns); request and response are
+translated to and from the OpenAI shape, including usage, so callers and the
+stats code see the same format whichever provider answered.
+"""
+
+import os
+import threading
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+
+OPENROUTER_API_BASE = os.getenv("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1").rstrip("/")
+OLLAMA_API_BASE = os.getenv("OLLAMA_API_BASE", "http://localhost:11434").rstrip("/")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Ollama model families that accept think=true; every other model rejects it, so
+# for those a profile's reasoning effort is dropped (reasoning off).
+OLLAMA_THINKING_MODELS = [
+    m.strip().lower()
+    for m in os.getenv("OLLAMA_THINKING_MODELS", "qwen3,deepseek-r1,gpt-oss,magistral").split(",")
+    if m.strip()
+]
+LOCAL_API_BASE = os.getenv("LOCAL_API_BASE", "http://localhost:1234/v1").rstrip("/")
+LOCAL_API_KEY = os.getenv("LOCAL_API_KEY", "")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# Model used by the DSPy modules (repair, optimization) on the Ollama server.
+DSPY_MODEL = os.getenv("DSPY_MODEL", "llama3")
+
+
+class Provider:
+    def __init__(self, name, base_url, kind="openai", api_key=""):
+        self.name = name
+        self.base_url = base_url
+        self.kind = kind        # "openai" (OpenAI-compatible) or "ollama" (native API)
+        self.api_key = api_key
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Pooled session shared by every call to this provider."""
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def chat_url(self):
+        if self.kind == "ollama":
+            return f"{self.base_url}/api/chat"
+        return f"{self.base_url}/chat/completions"
+
+    def headers(self, api_key=None):
+        headers = {"Content-Type": "application/json"}
+        key = api_key or self.api_key
+        if key:
+            headers["Authorization"] = f"Bearer {key}"
+        return headers
+
+
+PROVIDERS = {
+    "openrouter": Provider("openrouter", OPENROUTER_API_BASE),
+    "ollama": Provider("ollama", OLLAMA_API_BASE, kind="ollama"),
+    "local": Provider("local", LOCAL_API_BASE, api_key=LOCAL_API_KEY),
+}
+
+
+def split_model(model):
+    """'ollama/llama3' -> (ollama provider, 'llama3'); unprefixed ids belong to OpenRouter."""
+    prefix, _, rest = model.partition("/")
+    if rest and prefix in PROVIDERS and prefix != "openrouter":
+        return PROVIDERS[prefix], rest
+    return PROVIDERS["openrouter"], model
+
+
+# --- Ollama <-> OpenAI translation ---
+
+def ollama_supports_thinking(model):
+    """'qwen3:8b' -> True when its family is listed in OLLAMA_THINKING_MODELS."""
+    family = model.lower().split(":", 1)[0]
+    return any(family == m or family.startswith(m) for m in OLLAMA_THINKING_MODELS)
+
+
+def to_ollama_payload(payload):
+    options = {}
+    if "temperature" in payload:
+        options["temperature"] = payload["temperature"]
+    if payload.get("max_tokens"):
+        options["num_predict"] = payload["max_tokens"]
+    if payload.get("stop"):
+        options["stop"] = payload["stop"] if isinstance(payload["stop"], list) else [payload["stop"]]
+
+    native = {
+        "model": payload["model"],
+        "messages": payload["messages"],
+        "stream": bool(payload.get("stream")),
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": options,
+    }
+    if (payload.get("response_format") or {}).get("type") in ("json_object", "json_schema"):
+        native["format"] = "json"
+    reasoning = payload.get("reasoning") or {}
+    if ollama_supports_thinking(payload["model"]):
+        # Thinking models think by default unless told not to; the rest (e.g. llama3) reject `think` entirely.
+        native["think"] = bool(reasoning.get("effort") or reasoning.get("enabled"))
+    return native
+
+
+def ollama_usage(data):
+    prompt = data.get("prompt_eval_count") or 0
+    completion = data.get("eval_count") or 0
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+def from_ollama_response(data):
+    message = data.get("message") or {}
+    return {
+        "model": data.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": message.get("role", "assistant"), "content": message.get("content", "")},
+            "finish_reason": data.get("done_reason") or "stop",
+        }],
+        "usage": ollama_usage(data),
+    }
+
+
+# --- Preloading ---
+
+_preloaded = set()
+_preload_lock = threading.Lock()
+
+
+def preload(models):
+    """
+    Ask Ollama to load the given models now (in the background) so the first
+    turn doesn't pay the cold load. Non-Ollama specs and pools are handled;
+    each model is preloaded once per process (requests keep it warm after that).
+    """
+    specs = []
+    for model in models:
+        specs.extend(model if isinstance(model, (list, tuple)) else [model])
+
+    for spec in specs:
+        if not spec:
+            continue
+        provider, name = split_model(spec)
+        if provider.kind != "ollama":
+            continue
+        with _preload_lock:
+            if spec in _preloaded:
+                continue
+            _preloaded.add(spec)
+
+        def _load(provider=provider, name=name):
+            try:
+                provider.session.post(
+                    f"{provider.base_url}/api/generate",
+                    json={"model": name, "keep_alive": OLLAMA_KEEP_ALIVE},
+                    timeout=120,
+                )
+                print(f"🔥 Ollama: preloaded '{name}'.")
+            except Exception as e:
+                print(f"⚠️ Ollama preload failed for '{name}': {e}")
+
+        threading.Thread(target=_load, name=f"ollama-preload-{name}", daemon=True).start()
+
+
+def dspy_lm():
+    """The DSPy LM for the local Ollama server (one place instead of per-script hardcoding)."""
+    import dspy
+
+    return dspy.LM(f"ollama_chat/{DSPY_MODEL}", api_base=OLLAMA_API_BASE, api_key='')
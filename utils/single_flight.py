@@ -0,0 +1,63 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+The first caller for a key (the leader) runs the function; callers arriving
+with the same key while it is running wait for the leader's outcome instead of
+issuing their own request. Nothing is cached once the call completes.
+"""
+
+import copy
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._coalesced = 0
+
+    def do(self, key, fn):
+        """
+        Run fn() once per key among concurrent callers. Followers get a copy of
+        the leader's result, or the leader's exception re-raised.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._leaders += 1
+                leader = True
+            else:
+                self._coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # Followers get their own copy so nobody can mutate a shared response.
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self._leaders, "coalesced": self._coalesced, "in_flight": len(self._calls)}
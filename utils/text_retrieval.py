@@ -0,0 +1,123 @@
+"""
+Retrieval helpers shared by the memory stores: a small BM25 inverted index,
+MMR re-ranking, and packing of retrieved lessons into a token budget.
+Pure Python so the JSON store can use it without Chroma.
+"""
+
+import math
+import re
+from collections import Counter
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+# Crude but conservative chars-per-token estimate for budgeting prompt text.
+CHARS_PER_TOKEN = 4
+# BM25 score that maps to 0.5 in saturate(); roughly one distinctive shared term.
+BM25_HALF_SCORE = 1.0
+
+# Function words carry no topic; left in, "how do I ..." matches every "how do I ..." lesson.
+STOPWORDS = frozenset("""
+a about above after again all am an and any are as at be been before being below between both
+but by can could did do does doing down during each few for from further had has have having he
+her here hers him his how i if in into is it its itself just me more most my no nor not of off on
+once only or other our ours out over own same she should so some such than that the their them
+then there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_PATTERN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index; documents can be added incrementally."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self._lengths = []
+        self._postings = {}   # term -> {doc_index: term frequency}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, doc_id, text):
+        index = len(self.doc_ids)
+        terms = Counter(tokenize(text))
+        self.doc_ids.append(doc_id)
+        length = sum(terms.values())
+        self._lengths.append(length)
+        self._total_length += length
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[index] = tf
+
+    def search(self, query, k=10):
+        """[(doc_id, score)] best first; only documents sharing a query term are scored."""
+        n = len(self.doc_ids)
+        if n == 0:
+            return []
+        avg_length = self._total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / avg_length)
+                scores[index] = scores.get(index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[index], score) for index, score in best]
+
+
+def saturate(score, half=BM25_HALF_SCORE):
+    """
+    Map a raw BM25 score onto [0, 1) as score / (score + half). Unlike dividing
+    by the best score of the current query, this is absolute: a weak best match
+    stays weak, so cutoffs applied to it mean the same thing for every query.
+    """
+    return score / (score + half) if score > 0 else 0.0
+
+
+def mmr(candidates, relevance, similarity, k, diversity=0.3):
+    """
+    Maximal Marginal Relevance: greedily pick up to k candidates trading
+    relevance[c] against max similarity(c, already picked).
+    `diversity` 0 = pure relevance, 1 = pure novelty.
+    """
+    remaining = list(candidates)
+    selected = []
+    while remaining and len(selected) < k:
+        def _score(c):
+            redundancy = max((similarity(c, s) for s in selected), default=0.0)
+            return (1 - diversity) * relevance[c] - diversity * redundancy
+        best = max(remaining, key=_score)
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def pack_to_budget(entries, token_budget):
+    """
+    Keep formatted entries (best first) while they fit in token_budget.
+    The first entry is clipped rather than dropped, so a relevant lesson is
+    never lost to one long answer.
+    """
+    if token_budget is None:
+        return list(entries)
+    packed, used = [], 0
+    for entry in entries:
+        cost = estimate_tokens(entry) + 1
+        if used + cost <= token_budget:
+            packed.append(entry)
+            used += cost
+        elif not packed:
+            packed.append(entry[:max(0, token_budget * CHARS_PER_TOKEN - 3)] + "...")
+            break
+    return packed
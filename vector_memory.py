@@ -1,39 +1,531 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
 import chromadb
+import numpy as np
 from chromadb.utils import embedding_functions
 
-client = chromadb.PersistentClient(path='./chroma_db')
+from memory import answers_agree, normalize_question
+from utils.text_retrieval import BM25Index, mmr, pack_to_budget, saturate
+from vector_snapshot import SnapshotStore, export_collection, import_collection
+
+# "chroma" (persistent HNSW store) or "snapshot" (memory-mapped matrix, see
+# vector_snapshot.py; faster to open and query for small stores).
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "chroma")
+MEMORY_SNAPSHOT_DIR = os.getenv("MEMORY_SNAPSHOT_DIR", "./memory_snapshots")
+
+# Per-namespace cap; once exceeded, the least recalled / least recently used
+# lessons are evicted down to MEMORY_EVICT_TO of the cap (amortizes the scan).
+MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", "500"))
+MEMORY_EVICT_TO = float(os.getenv("MEMORY_EVICT_TO", "0.9"))
+MEMORY_COMPACTION_INTERVAL_SECONDS = float(os.getenv("MEMORY_COMPACTION_INTERVAL_SECONDS", "600"))
+# Cosine similarity at which consolidate() treats two questions as the same lesson
+# (their answers must agree too). Saves only replace exact normalized repeats.
+MEMORY_DEDUPE_SIMILARITY = float(os.getenv("MEMORY_DEDUPE_SIMILARITY", "0.95"))
+_DEDUPE_NEIGHBOURS = 5
+# Recall: fused score = alpha * cosine + (1 - alpha) * saturated BM25 (both absolute,
+# 0..1); below the cutoff nothing is injected.
+MEMORY_HYBRID_ALPHA = float(os.getenv("MEMORY_HYBRID_ALPHA", "0.7"))
+MEMORY_MIN_RELEVANCE = float(os.getenv("MEMORY_MIN_RELEVANCE", "0.35"))
+MEMORY_MMR_DIVERSITY = float(os.getenv("MEMORY_MMR_DIVERSITY", "0.3"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "400"))
+_RECALL_CANDIDATES = 20
+
+DEFAULT_NAMESPACE = "default"
+_BASE_COLLECTION = "agent_memory"
 
 sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
 
-collection = client.get_or_create_collection(
-    name="agent_memory",
-    embedding_function=sentence_transformer_ef
-)
+# Opened on first use so the snapshot backend never pays for it.
+_client = None
+_client_lock = threading.Lock()
+
+_collections = {}
+_snapshots = {}
+_collections_lock = threading.Lock()
+_compaction_thread = None
+_index_versions = {}    # collection name -> mutation counter
+_lexical_indexes = {}   # collection name -> (version, BM25Index)
+
+
+def _touch(coll):
+    """Mark a collection's documents as changed (invalidates its BM25 index)."""
+    _index_versions[coll.name] = _index_versions.get(coll.name, 0) + 1
+
+
+def _collection_name(namespace):
+    if not namespace or namespace == DEFAULT_NAMESPACE:
+        return _BASE_COLLECTION
+    slug = re.sub(r"[^a-zA-Z0-9_-]", "_", namespace)[:32].strip("_-")
+    # The digest keeps names unique after slugging and satisfies Chroma's 3-63 char rule.
+    digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:10]
+    return f"{_BASE_COLLECTION}__{slug}_{digest}" if slug else f"{_BASE_COLLECTION}__{digest}"
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = chromadb.PersistentClient(path='./chroma_db')
+        return _client
+
+
+def get_collection(namespace=None):
+    """Return (creating on first use) the Chroma collection for a user/tenant namespace."""
+    namespace = namespace or DEFAULT_NAMESPACE
+    with _collections_lock:
+        coll = _collections.get(namespace)
+        if coll is None:
+            # The default namespace keeps the original collection name so existing stores keep working.
+            coll = get_client().get_or_create_collection(
+                name=_collection_name(namespace),
+                embedding_function=sentence_transformer_ef,
+                metadata={"namespace": namespace},
+            )
+            _collections[namespace] = coll
+        return coll
+
+
+def list_namespaces():
+    """All namespaces present on disk (including ones not yet opened in this process)."""
+    namespaces = {DEFAULT_NAMESPACE}
+    client = get_client()
+    for item in client.list_collections():
+        # Older Chroma returns Collection objects, newer returns names.
+        name = getattr(item, "name", item)
+        if not name.startswith(f"{_BASE_COLLECTION}__"):
+            continue
+        coll = client.get_collection(name=name, embedding_function=sentence_transformer_ef)
+        namespace = (coll.metadata or {}).get("namespace")
+        if namespace:
+            namespaces.add(namespace)
+            with _collections_lock:
+                _collections.setdefault(namespace, coll)
+    return sorted(namespaces)
+
+
+def _eviction_victims(entries, max_entries):
+    """Ids to drop from [(id, metadata)]: least-recalled, then least-recently-used, down to the target size."""
+    count = len(entries)
+    if max_entries <= 0 or count <= max_entries:
+        return []
+    target = max(1, int(max_entries * MEMORY_EVICT_TO))
+    ranked = sorted(
+        entries,
+        key=lambda item: (
+            (item[1] or {}).get("recall_count", 0),
+            (item[1] or {}).get("last_used_at", 0.0),
+        ),
+    )
+    return [entry_id for entry_id, _ in ranked[:count - target]]
+
+
+def _evict(coll, max_entries):
+    """Enforce the size cap on a collection. Returns the number of evicted lessons."""
+    if max_entries <= 0 or coll.count() <= max_entries:
+        return 0
+
+    entries = coll.get(include=["metadatas"])
+    victims = _eviction_victims(list(zip(entries["ids"], entries["metadatas"])), max_entries)
+    if victims:
+        coll.delete(ids=victims)
+        _touch(coll)
+        print(f"🧹 Memory: evicted {len(victims)} lessons from '{coll.name}'.")
+    return len(victims)
+
+
+def _unit(vectors):
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
 
-def save_memory(question, answer):
-    collection.upsert(
+
+def _same_question(coll, question):
+    """Ids of stored questions equal to `question` once normalized (excluding itself)."""
+    if coll.count() == 0:
+        return [], []
+
+    embedding = _unit(sentence_transformer_ef([question]))[0]
+    results = coll.query(
+        query_embeddings=[embedding.tolist()],
+        n_results=min(_DEDUPE_NEIGHBOURS, coll.count()),
+        include=["metadatas", "documents"],
+    )
+    ids = results["ids"][0]
+    if not ids:
+        return [], []
+
+    norm = normalize_question(question)
+    duplicates, metadatas = [], []
+    for entry_id, document, metadata in zip(ids, results["documents"][0], results["metadatas"][0]):
+        if entry_id != question and normalize_question(document) == norm:
+            duplicates.append(entry_id)
+            metadatas.append(metadata or {})
+    return duplicates, metadatas
+
+
+def save_memory(question, answer, namespace=None, max_entries=None):
+    """
+    Store a lesson. The same question already stored under different
+    case/spacing/punctuation is folded into this one (newest answer wins,
+    recall history is kept); fuzzier matches are left to consolidate().
+    Returns the namespace size.
+    """
+    if MEMORY_BACKEND == "snapshot":
+        return _snapshot_save(question, answer, namespace, max_entries)
+
+    coll = get_collection(namespace)
+    now = time.time()
+    metadata = {"answer": answer, "created_at": now, "last_used_at": now, "recall_count": 0}
+
+    # Re-teaching an existing lesson keeps its recall history.
+    existing = coll.get(ids=[question], include=["metadatas"])
+    if existing["ids"]:
+        previous = existing["metadatas"][0] or {}
+        metadata["created_at"] = previous.get("created_at", now)
+        metadata["recall_count"] = previous.get("recall_count", 0)
+
+    duplicates, dup_metadatas = _same_question(coll, question)
+    if duplicates:
+        metadata["recall_count"] += sum(m.get("recall_count", 0) for m in dup_metadatas)
+        metadata["created_at"] = min([metadata["created_at"]] + [m.get("created_at", now) for m in dup_metadatas])
+        coll.delete(ids=duplicates)
+        print(f"🧬 Memory: merged {len(duplicates)} duplicate lessons.")
+
+    coll.upsert(
         documents=[question], 
-        metadatas=[{"answer": answer}],
+        metadatas=[metadata],
         ids=[question]
     )
+    _touch(coll)
+    _evict(coll, MEMORY_MAX_ENTRIES if max_entries is None else max_entries)
+
+    return coll.count()
+
+
+def _recalled(metadatas):
+    now = time.time()
+    updated = []
+    for metadata in metadatas:
+        metadata = dict(metadata or {})
+        metadata["recall_count"] = metadata.get("recall_count", 0) + 1
+        metadata["last_used_at"] = now
+        updated.append(metadata)
+    return updated
+
+
+def _record_recall(coll, ids, metadatas):
+    updated = _recalled(metadatas)
+    try:
+        coll.update(ids=ids, metadatas=updated)
+    except Exception as e:
+        # Stats are best-effort; a failed update must not break recall.
+        print(f"⚠️ Memory: failed to record recall stats: {e}")
+
+
+def _lexical_index(coll):
+    """BM25 index over question + answer text, rebuilt only after the collection changed."""
+    version = _index_versions.get(coll.name, 0)
+    cached = _lexical_indexes.get(coll.name)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    index = BM25Index()
+    entries = coll.get(include=["documents", "metadatas"])
+    for entry_id, document, metadata in zip(entries["ids"], entries["documents"], entries["metadatas"]):
+        index.add(entry_id, f"{document} {(metadata or {}).get('answer', '')}")
+    _lexical_indexes[coll.name] = (version, index)
+    return index
+
+
+def _fuse(vectors, query_vector, lexical):
+    """Hybrid relevance per candidate id: alpha * cosine + (1 - alpha) * saturated BM25."""
+    return {
+        i: MEMORY_HYBRID_ALPHA * max(float(vector @ query_vector), 0.0)
+        + (1 - MEMORY_HYBRID_ALPHA) * saturate(lexical.get(i, 0.0))
+        for i, vector in vectors.items()
+    }
+
+
+def get_relevant_examples(query_text, k=2, namespace=None, token_budget=None, min_relevance=None):
+    """
+    Hybrid recall: BM25 over stored questions/answers fused with embedding
+    cosine similarity, a relevance cutoff, MMR for diversity, and a hard token
+    budget on the returned block. Returns "" when nothing is relevant enough.
+    """
+    token_budget = MEMORY_TOKEN_BUDGET if token_budget is None else token_budget
+    min_relevance = MEMORY_MIN_RELEVANCE if min_relevance is None else min_relevance
+    if MEMORY_BACKEND == "snapshot":
+        return _snapshot_recall(query_text, k, namespace, token_budget, min_relevance)
 
-    return collection.count()
+    coll = get_collection(namespace)
+    total = coll.count()
+    if total == 0:
+        return ""
+
+    n = min(_RECALL_CANDIDATES, total)
 
-def get_relevant_examples(query_text, k=2):
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=k
+    query_vector = _unit(sentence_transformer_ef([query_text]))[0]
+    results = coll.query(
+        query_embeddings=[query_vector.tolist()],
+        n_results=n,
+        include=["documents", "metadatas", "embeddings"],
     )
+    candidates = {}
+    for entry_id, document, metadata, embedding in zip(
+        results["ids"][0], results["documents"][0], results["metadatas"][0], results["embeddings"][0]
+    ):
+        candidates[entry_id] = (document, metadata or {}, embedding)
+
+    lexical = dict(_lexical_index(coll).search(query_text, k=n))
+    missing = [entry_id for entry_id in lexical if entry_id not in candidates]
+    if missing:
+        extra = coll.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+        for entry_id, document, metadata, embedding in zip(extra["ids"], extra["documents"], extra["metadatas"], extra["embeddings"]):
+            candidates[entry_id] = (document, metadata or {}, embedding)
+    if not candidates:
+        return ""
 
-    if not results['documents'][0]:
+    ids = list(candidates)
+    vectors = dict(zip(ids, _unit([candidates[i][2] for i in ids])))
+    relevance = _fuse(vectors, query_vector, lexical)
+    relevant = [i for i in ids if relevance[i] >= min_relevance]
+    if not relevant:
         return ""
-    
-    formatted_memories = []
 
-    for i in range(len(results['documents'][0])):
-        past_question = results['documents'][0][i]
-        past_answer = results['metadatas'][0][i]['answer']
+    picked = mmr(relevant, relevance, lambda a, b: float(vectors[a] @ vectors[b]), k, MEMORY_MMR_DIVERSITY)
+    formatted_memories = pack_to_budget(
+        [
+            f"- Context: When asked '{candidates[i][0]}', the answer was: '{candidates[i][1].get('answer', '')}'"
+            for i in picked
+        ],
+        token_budget,
+    )
+    used = picked[:len(formatted_memories)]
 
-        formatted_memories.append(f"- Context: When asked '{past_question}', the answer was: '{past_answer}'")
+    _record_recall(coll, used, [candidates[i][1] for i in used])
         
-    return "\n".join(formatted_memories)
\ No newline at end of file
+    return "\n".join(formatted_memories)
+
+
+# --- Snapshot backend ---
+
+def get_snapshot(namespace=None):
+    """Memory-mapped store for a namespace (directory named like its Chroma collection)."""
+    namespace = namespace or DEFAULT_NAMESPACE
+    with _collections_lock:
+        store = _snapshots.get(namespace)
+        if store is None:
+            store = SnapshotStore(os.path.join(MEMORY_SNAPSHOT_DIR, _collection_name(namespace)))
+            _snapshots[namespace] = store
+        return store
+
+
+def export_snapshot(namespace=None):
+    """Copy a namespace from Chroma into its snapshot directory. Returns the row count."""
+    count = export_collection(get_collection(namespace), get_snapshot(namespace).path)
+    print(f"📦 Memory: exported {count} lessons to snapshot.")
+    return count
+
+
+def import_snapshot(namespace=None):
+    """Load a namespace's snapshot back into Chroma. Returns the row count."""
+    count = import_collection(get_snapshot(namespace).path, get_collection(namespace))
+    _touch(get_collection(namespace))
+    print(f"📦 Memory: imported {count} lessons from snapshot.")
+    return count
+
+
+def _snapshot_evict(store, max_entries):
+    if max_entries <= 0 or len(store) <= max_entries:
+        return 0
+    victims = _eviction_victims(store.entries(), max_entries)
+    if victims:
+        store.delete(victims)
+        print(f"🧹 Memory: evicted {len(victims)} lessons from '{os.path.basename(store.path)}'.")
+    return len(victims)
+
+
+def _snapshot_lexical_index(store):
+    """Same BM25 index as _lexical_index(), rebuilt only when lessons are added or removed (not on recall stats)."""
+    revision = store.revision()
+    cached = _lexical_indexes.get(store.path)
+    if cached and cached[0] == revision:
+        return cached[1]
+
+    index = BM25Index()
+    for entry_id, metadata in store.entries():
+        index.add(entry_id, f"{metadata.get('question', entry_id)} {metadata.get('answer', '')}")
+    _lexical_indexes[store.path] = (revision, index)
+    return index
+
+
+def _snapshot_save(question, answer, namespace, max_entries):
+    """save_memory() for the snapshot backend: same merge rules, recall history and size cap."""
+    store = get_snapshot(namespace)
+    embedding = _unit(sentence_transformer_ef([question]))[0]
+    now = time.time()
+    metadata = {"question": question, "answer": answer, "created_at": now, "last_used_at": now, "recall_count": 0}
+
+    norm = normalize_question(question)
+    previous = []
+    duplicates = []
+    for entry_id, _, meta in store.search([embedding], k=_DEDUPE_NEIGHBOURS)[0]:
+        if entry_id == question:
+            previous.append(meta)
+        elif normalize_question(meta.get("question", "")) == norm:
+            duplicates.append(entry_id)
+            previous.append(meta)
+    if previous:
+        # Re-teaching an existing lesson keeps its recall history.
+        metadata["recall_count"] = sum(m.get("recall_count", 0) for m in previous)
+        metadata["created_at"] = min([now] + [m.get("created_at", now) for m in previous])
+    if duplicates:
+        store.delete(duplicates)
+        print(f"🧬 Memory: merged {len(duplicates)} duplicate lessons.")
+
+    store.add(question, embedding, metadata)
+    _snapshot_evict(store, MEMORY_MAX_ENTRIES if max_entries is None else max_entries)
+    return len(store)
+
+
+def _snapshot_recall(query_text, k, namespace, token_budget, min_relevance):
+    """get_relevant_examples() for the snapshot backend: same fusion, cutoff, MMR and recall stats."""
+    store = get_snapshot(namespace)
+    query_vector = _unit(sentence_transformer_ef([query_text]))[0]
+    semantic = [entry_id for entry_id, _, _ in store.search([query_vector], k=_RECALL_CANDIDATES)[0]]
+    lexical = dict(_snapshot_lexical_index(store).search(query_text, k=_RECALL_CANDIDATES))
+
+    # Vectors and metadata of every candidate in one locked read
+    found = store.get(list(dict.fromkeys(semantic + list(lexical))))
+    if not found:
+        return ""
+    vectors = {entry_id: vector for entry_id, (vector, _) in found.items()}
+    metadata = {entry_id: meta for entry_id, (_, meta) in found.items()}
+
+    relevance = _fuse(vectors, query_vector, lexical)
+    relevant = [i for i in vectors if relevance[i] >= min_relevance]
+    if not relevant:
+        return ""
+
+    picked = mmr(relevant, relevance, lambda a, b: float(vectors[a] @ vectors[b]), k, MEMORY_MMR_DIVERSITY)
+    formatted_memories = pack_to_budget(
+        [
+            f"- Context: When asked '{metadata[i].get('question', i)}', the answer was: '{metadata[i].get('answer', '')}'"
+            for i in picked
+        ],
+        token_budget,
+    )
+    used = picked[:len(formatted_memories)]
+
+    try:
+        store.update(used, _recalled([metadata[i] for i in used]))
+    except Exception as e:
+        # Stats are best-effort; a failed update must not break recall.
+        print(f"⚠️ Memory: failed to record recall stats: {e}")
+
+    return "\n".join(formatted_memories)
+
+
+def compact(namespace=None, max_entries=None):
+    """
+    Enforce the size cap on one namespace, or on every namespace when None.
+    Returns the number of evicted lessons.
+    """
+    limit = MEMORY_MAX_ENTRIES if max_entries is None else max_entries
+    if MEMORY_BACKEND == "snapshot":
+        # Snapshot directories don't record their namespace; cover the ones opened by this process.
+        namespaces = [namespace] if namespace else list(_snapshots)
+        return sum(_snapshot_evict(get_snapshot(ns), limit) for ns in namespaces)
+    namespaces = [namespace] if namespace else list_namespaces()
+    return sum(_evict(get_collection(ns), limit) for ns in namespaces)
+
+
+def consolidate(namespace=None, dedupe_similarity=None):
+    """
+    Batch near-duplicate pass over one namespace (or all when None). Entries are
+    visited newest first; an entry whose question is too similar to an already
+    kept entry's AND whose answer agrees with it is deleted and its recall
+    count folded into the survivor.
+    Returns the number of removed lessons.
+    """
+    threshold = MEMORY_DEDUPE_SIMILARITY if dedupe_similarity is None else dedupe_similarity
+    namespaces = [namespace] if namespace else list_namespaces()
+    removed = 0
+
+    for ns in namespaces:
+        coll = get_collection(ns)
+        entries = coll.get(include=["embeddings", "metadatas", "documents"])
+        if len(entries["ids"]) < 2:
+            continue
+
+        metadatas = [m or {} for m in entries["metadatas"]]
+        order = sorted(range(len(entries["ids"])), key=lambda i: metadatas[i].get("created_at", 0.0), reverse=True)
+        vectors = _unit(entries["embeddings"])
+        norms = [normalize_question(doc) for doc in entries["documents"]]
+
+        kept, absorbed, victims = [], {}, []
+        for i in order:
+            owner = None
+            if kept:
+                sims = vectors[kept] @ vectors[i]
+                answer = metadatas[i].get("answer", "")
+                owner = next(
+                    (
+                        k for k, sim in zip(kept, sims)
+                        if (sim >= threshold or norms[k] == norms[i])
+                        and answers_agree(answer, metadatas[k].get("answer", ""))
+                    ),
+                    None,
+                )
+            if owner is None:
+                kept.append(i)
+            else:
+                victims.append(entries["ids"][i])
+                absorbed[owner] = absorbed.get(owner, 0) + metadatas[i].get("recall_count", 0)
+
+        if victims:
+            coll.delete(ids=victims)
+            _touch(coll)
+            survivors = list(absorbed)
+            coll.update(
+                ids=[entries["ids"][k] for k in survivors],
+                metadatas=[
+                    {**metadatas[k], "recall_count": metadatas[k].get("recall_count", 0) + absorbed[k]}
+                    for k in survivors
+                ],
+            )
+            print(f"🧬 Memory: consolidated {len(victims)} near-duplicates in '{coll.name}'.")
+            removed += len(victims)
+
+    return removed
+
+
+def start_compaction_thread(interval=None):
+    """Run consolidate() and compact() periodically on a daemon thread. Safe to call more than once."""
+    global _compaction_thread
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return _compaction_thread
+
+    interval = MEMORY_COMPACTION_INTERVAL_SECONDS if interval is None else interval
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                if MEMORY_BACKEND == "snapshot":
+                    compact()
+                    for store in list(_snapshots.values()):
+                        store.compact()
+                    continue
+                consolidate()
+                compact()
+            except Exception as e:
+                print(f"⚠️ Memory compaction error: {e}")
+
+    _compaction_thread = threading.Thread(target=_loop, name="memory-compaction", daemon=True)
+    _compaction_thread.start()
+    return _compaction_thread
@@ -0,0 +1,416 @@
+"""
+Memory-mapped snapshot backend for small lesson stores (< ~100k entries).
+
+Layout of a snapshot directory:
+    vectors-<version>.npy   N x D unit-normalized embeddings (float16 or float32)
+    meta-<version>.jsonl    one JSON object per row ({"id", "question", "answer", ...})
+    index.json              {"version", "ids", "offsets", "dim", "dtype"} (byte offsets into meta)
+    pending.jsonl           changes since the last compaction: saves {"id", "embedding", "metadata"},
+                            metadata-only updates {"id", "metadata"}, deletes {"id", "deleted"}
+
+Search is a brute-force dot product over the memory-mapped matrix, in row
+blocks, for a whole batch of queries at once. np.load(mmap_mode="r") shares
+the OS page cache, so worker processes read the same pages without copies.
+Saves append to pending.jsonl and are folded into a new versioned snapshot by
+compact(); readers notice the new index.json and reopen. Writers and
+compaction hold an exclusive flock on <dir>/.lock (readers a shared one), so
+processes sharing the directory never lose a save to a concurrent compaction.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+SNAPSHOT_DTYPE = os.getenv("MEMORY_SNAPSHOT_DTYPE", "float16")
+# Fold pending saves into the matrix once this many have accumulated.
+SNAPSHOT_COMPACT_AFTER = int(os.getenv("MEMORY_SNAPSHOT_COMPACT_AFTER", "256"))
+_SEARCH_BLOCK_ROWS = 65536
+
+
+def _unit(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def write_snapshot(path, ids, embeddings, metadatas, dtype=SNAPSHOT_DTYPE):
+    """
+    Write a new versioned snapshot and atomically switch index.json to it.
+    Files of older versions are removed; processes that still map them keep
+    a valid view until they reopen (POSIX unlink semantics).
+    """
+    os.makedirs(path, exist_ok=True)
+    previous = _read_index(path)
+    version = (previous or {}).get("version", 0) + 1
+
+    vectors = _unit(embeddings) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+    np.save(os.path.join(path, f"vectors-{version}.npy"), vectors.astype(dtype))
+
+    offsets = []
+    with open(os.path.join(path, f"meta-{version}.jsonl"), "wb") as f:
+        for entry_id, metadata in zip(ids, metadatas):
+            offsets.append(f.tell())
+            f.write(json.dumps({"id": entry_id, **(metadata or {})}, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    index = {"version": version, "ids": list(ids), "offsets": offsets, "dim": int(vectors.shape[1]) if len(ids) else 0, "dtype": dtype}
+    tmp = os.path.join(path, "index.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, os.path.join(path, "index.json"))
+
+    if previous:
+        for name in (f"vectors-{previous['version']}.npy", f"meta-{previous['version']}.jsonl"):
+            try:
+                os.remove(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+    return version
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _read_index(path):
+    try:
+        with open(os.path.join(path, "index.json"), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def export_collection(coll, path, dtype=SNAPSHOT_DTYPE):
+    """Snapshot a Chroma collection (embeddings + metadata). Returns the row count."""
+    entries = coll.get(include=["embeddings", "documents", "metadatas"])
+    metadatas = [
+        {"question": document, **(metadata or {})}
+        for document, metadata in zip(entries["documents"], entries["metadatas"])
+    ]
+    write_snapshot(path, entries["ids"], entries["embeddings"], metadatas, dtype)
+    return len(entries["ids"])
+
+
+def import_collection(path, coll, batch_size=1000):
+    """Load a snapshot (plus pending saves) into a Chroma collection. Returns the row count."""
+    store = SnapshotStore(path)
+    ids, embeddings, metadatas = store.dump()
+    for start in range(0, len(ids), batch_size):
+        batch = slice(start, start + batch_size)
+        coll.upsert(
+            ids=ids[batch],
+            embeddings=[e.tolist() for e in embeddings[batch]],
+            documents=[m.pop("question", i) for i, m in zip(ids[batch], metadatas[batch])],
+            metadatas=metadatas[batch],
+        )
+    return len(ids)
+
+
+class SnapshotStore:
+    def __init__(self, path, compact_after=SNAPSHOT_COMPACT_AFTER):
+        self.path = path
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(path, ".lock")
+        self._index_key = None
+        self._version = None
+        self._vectors = None
+        self._ids = []
+        self._offsets = []
+        self._row_of = {}
+        self._pending = {}   # id -> (unit vector, metadata); overrides snapshot rows
+        self._deleted = set()   # ids removed since the last compaction
+        self._meta_updates = {}   # id -> metadata for snapshot rows (e.g. recall stats), vector unchanged
+        self._pending_key = None
+        self._pending_offset = 0   # bytes of pending.jsonl already applied
+        self._content_changes = 0   # add/delete records applied since pending.jsonl was (re)loaded
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """Thread lock plus a cross-process flock; yields with a refreshed view."""
+        with self._lock:
+            if fcntl is None:
+                self._refresh()
+                yield
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- loading ---
+    def _refresh(self):
+        """
+        Reopen the mmap if another process published a new version; apply new pending records.
+        Both files are stat'ed first, and pending.jsonl is append-only between
+        compactions, so an unchanged store costs two stat calls.
+        """
+        index_key = _stat_key(os.path.join(self.path, "index.json"))
+        if index_key is None or index_key != self._index_key:
+            index = _read_index(self.path)
+            version = index["version"] if index else 0
+            if version != self._version:
+                if index and index["ids"]:
+                    self._vectors = np.load(os.path.join(self.path, f"vectors-{version}.npy"), mmap_mode="r")
+                else:
+                    self._vectors = None
+                self._ids = index["ids"] if index else []
+                self._offsets = index["offsets"] if index else []
+                self._row_of = {entry_id: row for row, entry_id in enumerate(self._ids)}
+                self._version = version
+                self._pending_key = None
+            self._index_key = index_key
+
+        pending_path = os.path.join(self.path, "pending.jsonl")
+        # mtime alone can miss an append from another process within the same tick
+        pending_key = _stat_key(pending_path)
+        if pending_key == self._pending_key:
+            return
+        if pending_key is None or self._pending_key is None or pending_key[1] < self._pending_offset:
+            # New snapshot version, or the file was removed/rewritten by a compaction
+            self._pending = {}
+            self._deleted = set()
+            self._meta_updates = {}
+            self._pending_offset = 0
+            self._content_changes = 0
+        if pending_key is not None:
+            with open(pending_path, "rb") as f:
+                f.seek(self._pending_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Partial last line; re-read once it is complete
+                    self._pending_offset += len(line)
+                    try:
+                        self._apply(json.loads(line))
+                    except (json.JSONDecodeError, KeyError):
+                        continue  # Torn write from a crash
+        self._pending_key = pending_key
+
+    def _apply(self, record):
+        entry_id = record["id"]
+        if record.get("deleted"):
+            self._pending.pop(entry_id, None)
+            self._meta_updates.pop(entry_id, None)
+            self._deleted.add(entry_id)
+            self._content_changes += 1
+        elif "embedding" in record:
+            self._pending[entry_id] = (_unit(record["embedding"])[0], record["metadata"])
+            self._meta_updates.pop(entry_id, None)
+            self._deleted.discard(entry_id)
+            self._content_changes += 1
+        elif entry_id in self._pending:
+            self._pending[entry_id] = (self._pending[entry_id][0], record["metadata"])
+        elif entry_id in self._row_of and entry_id not in self._deleted:
+            self._meta_updates[entry_id] = record["metadata"]
+
+    def _append(self, records):
+        """Write records to pending.jsonl and apply them to this process's view."""
+        pending_path = os.path.join(self.path, "pending.jsonl")
+        with open(pending_path, "ab") as f:
+            for record in records:
+                line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                f.write(line)
+                self._pending_offset += len(line)
+                self._apply(record)
+        self._pending_key = _stat_key(pending_path)
+        return len(self._pending) + len(self._deleted) + len(self._meta_updates) >= self.compact_after
+
+    def _metadata(self, row):
+        entry_id = self._ids[row]
+        if entry_id in self._meta_updates:
+            return dict(self._meta_updates[entry_id])
+        with open(os.path.join(self.path, f"meta-{self._version}.jsonl"), "rb") as f:
+            f.seek(self._offsets[row])
+            record = json.loads(f.readline())
+        record.pop("id", None)
+        return record
+
+    def __len__(self):
+        with self._locked():
+            base = sum(1 for entry_id in self._ids if entry_id not in self._deleted)
+            return base + sum(1 for entry_id in self._pending if entry_id not in self._row_of or entry_id in self._deleted)
+
+    # --- writes ---
+    def add(self, entry_id, embedding, metadata):
+        """Durably record a lesson; it is searchable immediately and folded in on compaction."""
+        vector = _unit(embedding)[0]
+        with self._locked(exclusive=True):
+            should_compact = self._append([{"id": entry_id, "embedding": vector.tolist(), "metadata": metadata}])
+        if should_compact:
+            self.compact()
+
+    def update(self, ids, metadatas):
+        """
+        Replace the metadata of existing lessons (e.g. recall stats); unknown ids are skipped.
+        Records carry no embedding and don't change revision().
+        """
+        with self._locked(exclusive=True):
+            records = [
+                {"id": entry_id, "metadata": metadata}
+                for entry_id, metadata in zip(ids, metadatas)
+                if self._vector(entry_id) is not None
+            ]
+            should_compact = self._append(records) if records else False
+        if should_compact:
+            self.compact()
+
+    def delete(self, ids):
+        """Durably remove lessons (tombstones until the next compaction)."""
+        with self._locked(exclusive=True):
+            self._append([{"id": entry_id, "deleted": True} for entry_id in ids])
+
+    def entries(self):
+        """[(id, metadata)] of the merged store, without loading vectors."""
+        with self._locked():
+            items = []
+            if self._ids:
+                # One sequential pass over the metadata file instead of a seek per row
+                with open(os.path.join(self.path, f"meta-{self._version}.jsonl"), "rb") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        entry_id = record.pop("id")
+                        if entry_id not in self._pending and entry_id not in self._deleted:
+                            items.append((entry_id, dict(self._meta_updates.get(entry_id, record))))
+            return items + [(entry_id, dict(metadata)) for entry_id, (_, metadata) in self._pending.items()]
+
+    def get(self, ids):
+        """{id: (unit vector, metadata)} for the ids that exist, under a single lock."""
+        with self._locked():
+            found = {}
+            for entry_id in ids:
+                if entry_id in self._deleted:
+                    continue
+                if entry_id in self._pending:
+                    vector, metadata = self._pending[entry_id]
+                    found[entry_id] = (vector, dict(metadata))
+                elif entry_id in self._row_of:
+                    row = self._row_of[entry_id]
+                    found[entry_id] = (np.asarray(self._vectors[row], dtype=np.float32), self._metadata(row))
+            return found
+
+    def revision(self):
+        """Changes whenever lessons are added or removed (in this or another process); metadata updates don't count."""
+        with self._locked():
+            return self._version, self._content_changes
+
+    def dump(self):
+        """(ids, float32 unit vectors, metadatas) of the merged store."""
+        with self._locked():
+            return self._dump()
+
+    def _dump(self):
+        ids, vectors, metadatas = [], [], []
+        for row, entry_id in enumerate(self._ids):
+            if entry_id in self._pending or entry_id in self._deleted:
+                continue
+            ids.append(entry_id)
+            vectors.append(np.asarray(self._vectors[row], dtype=np.float32))
+            metadatas.append(self._metadata(row))
+        for entry_id, (vector, metadata) in self._pending.items():
+            ids.append(entry_id)
+            vectors.append(vector)
+            metadatas.append(dict(metadata))
+        return ids, np.array(vectors, dtype=np.float32), metadatas
+
+    def compact(self):
+        """
+        Fold pending saves into a new snapshot version (no-op when nothing is pending).
+        Dump, write and removal of pending.jsonl happen under one exclusive lock,
+        so a concurrent add()/delete() lands either before the dump or after the reset.
+        """
+        with self._locked(exclusive=True):
+            if not self._pending and not self._deleted and not self._meta_updates:
+                return
+            ids, vectors, metadatas = self._dump()
+            write_snapshot(self.path, ids, vectors, metadatas, dtype=SNAPSHOT_DTYPE)
+            try:
+                os.remove(os.path.join(self.path, "pending.jsonl"))
+            except FileNotFoundError:
+                pass
+            self._refresh()
+
+    # --- search ---
+    def search(self, query_embeddings, k=5):
+        """
+        Batched top-k by cosine similarity. Returns, per query, a list of
+        (id, score, metadata) best first.
+        """
+        queries = _unit(query_embeddings)
+        with self._locked():
+            count = len(self._ids)
+            best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+
+            if self._vectors is not None and count:
+                superseded = self._deleted.union(self._pending)
+                masked = np.array([self._row_of[i] for i in superseded if i in self._row_of], dtype=np.int64)
+                for start in range(0, count, _SEARCH_BLOCK_ROWS):
+                    block = np.asarray(self._vectors[start:start + _SEARCH_BLOCK_ROWS], dtype=np.float32)
+                    scores = queries @ block.T
+                    if len(masked):
+                        local = masked[(masked >= start) & (masked < start + len(block))] - start
+                        scores[:, local] = -np.inf  # Superseded by a pending save or delete
+                    rows = np.arange(start, start + len(block))
+                    best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores, np.broadcast_to(rows, scores.shape), k)
+
+            pending_ids = list(self._pending)
+            if pending_ids:
+                scores = queries @ np.stack([self._pending[i][0] for i in pending_ids]).T
+                # Pending rows are addressed as count + position
+                rows = np.arange(count, count + len(pending_ids))
+                best_scores, best_rows = _merge_top_k(best_scores, best_rows, scores, np.broadcast_to(rows, scores.shape), k)
+
+            results = []
+            for q in range(len(queries)):
+                hits = []
+                for score, row in zip(best_scores[q], best_rows[q]):
+                    if not np.isfinite(score):
+                        continue
+                    if row < count:
+                        hits.append((self._ids[row], float(score), self._metadata(row)))
+                    else:
+                        entry_id = pending_ids[row - count]
+                        hits.append((entry_id, float(score), dict(self._pending[entry_id][1])))
+                results.append(hits)
+            return results
+
+    def vector(self, entry_id):
+        """Unit vector of a stored entry (for MMR), or None."""
+        with self._locked():
+            return self._vector(entry_id)
+
+    def _vector(self, entry_id):
+        if entry_id in self._deleted:
+            return None
+        if entry_id in self._pending:
+            return self._pending[entry_id][0]
+        row = self._row_of.get(entry_id)
+        return None if row is None else np.asarray(self._vectors[row], dtype=np.float32)
+
+
+def _merge_top_k(best_scores, best_rows, scores, rows, k):
+    scores = np.concatenate([best_scores, scores], axis=1)
+    rows = np.concatenate([best_rows, rows], axis=1)
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        rows = np.take_along_axis(rows, top, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)